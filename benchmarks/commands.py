@@ -0,0 +1,280 @@
+"""
+End-to-end latency of the bot commands against local stand-in Trakt, TMDB and image servers.
+
+Each command callback is invoked with a fake ctx, `--iterations` times with at most
+`--concurrency` in flight, after a warm-up sync of the benchmark users. Reports p50/p95/p99
+latency, throughput and upstream bytes per invocation, and stores the results as JSON
+under benchmarks/results/ so runs can be compared.
+
+    python -m benchmarks.commands
+    python -m benchmarks.commands --commands t6 tw-all --concurrency 8 --latency 120
+    python -m benchmarks.commands --compare benchmarks/results/commands-20250101-120000.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import database.database as db
+import tmbd_api
+import trakt_api
+from benchmarks.fake_upstream import FakeUpstream, UpstreamConfig
+from models.collage import CollageCog
+from models.recent import RecentCog
+from models.recent6 import Recent6Cog, Recent6CogShow
+from models.register import RegisterCog
+from models.watchlist import WatchlistCog
+from utils import image_grid
+from utils.http import close_session
+from utils.import_jobs import import_queue
+from utils.metrics import current_command
+from utils.poster_cache import poster_cache
+from utils.rate_limit import image_limiter, tmdb_limiter, trakt_limiter
+from utils.render_pool import shutdown_render_pool
+from utils.trakt_utils import sync_history
+from utils.user_registry import user_registry
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+COMMANDS = ["tr", "t6", "t6s", "tw", "tw-all", "t9", "tset"]
+UPSTREAMS = ["trakt", "tmdb", "images"]
+
+
+class FakeMessage:
+    def __init__(self, message_id):
+        self.id = message_id
+
+    async def edit(self, **kwargs):
+        return self
+
+
+class FakeCtx:
+    """Just enough of commands.Context for the cog callbacks."""
+
+    _next_message_id = 1
+
+    def __init__(self, author_id, name, command):
+        self.author = SimpleNamespace(id=author_id, display_name=name, mention=f"<@{author_id}>")
+        self.channel = SimpleNamespace(id=1)
+        self.prefix = "!"
+        self.invoked_with = command
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+        FakeCtx._next_message_id += 1
+        return FakeMessage(FakeCtx._next_message_id)
+
+
+class FakeInteraction:
+    def __init__(self):
+        self.response = SimpleNamespace(defer=self._ignore, edit_message=self._ignore)
+        self.followup = SimpleNamespace(send=self._ignore)
+
+    async def _ignore(self, *args, **kwargs):
+        pass
+
+    async def edit_original_response(self, **kwargs):
+        pass
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _clear_memory_caches():
+    image_grid.grid_cache.clear()
+    image_grid.tile_cache.clear()
+    poster_cache.memory.clear()
+
+
+class Bench:
+    def __init__(self, args, upstream):
+        self.args = args
+        self.upstream = upstream
+        self.users = [(1000 + i, f"bench-user-{i}") for i in range(args.users)]
+        self.cogs = SimpleNamespace(
+            recent=RecentCog(None), recent6=Recent6Cog(None), recent6s=Recent6CogShow(None),
+            watchlist=WatchlistCog(None), collage=CollageCog(None), register=RegisterCog(None)
+        )
+        self._tset_runs = 0
+
+    async def invoke(self, command, n):
+        author_id, username = self.users[n % len(self.users)]
+        ctx = FakeCtx(author_id, username, command)
+        cogs = self.cogs
+
+        if command == "tr":
+            await cogs.recent.trakt_recent.callback(cogs.recent, ctx)
+        elif command == "t6":
+            await cogs.recent6.trakt_six_recent.callback(cogs.recent6, ctx)
+        elif command == "t6s":
+            await cogs.recent6s.trakt_six_recent.callback(cogs.recent6s, ctx)
+        elif command in ("tw", "tw-all"):
+            await cogs.watchlist.trakt_watchlist.callback(cogs.watchlist, ctx)
+            if command == "tw-all":
+                view = ctx.sent[-1][1]["view"]
+                await view.show_all(FakeInteraction())
+                view.stop()
+            else:
+                # Like the view timing out: the background prefetch is dropped
+                view = ctx.sent[-1][1]["view"]
+                view.stop()
+                await view.on_timeout()
+        elif command == "t9":
+            await cogs.collage.trakt_collage_9.callback(cogs.collage, ctx, "all", "all")
+        elif command == "tset":
+            # A fresh account each time, timed until its import job has finished
+            self._tset_runs += 1
+            new_username = f"bench-new-{os.getpid()}-{self._tset_runs}"
+            await cogs.register.trakt_register.callback(cogs.register, ctx, new_username)
+            while new_username in import_queue.jobs:
+                await asyncio.sleep(0.01)
+        else:
+            raise ValueError(f"unknown command {command}")
+
+    async def run_command(self, command):
+        bytes_before = dict(self.upstream.bytes_sent)
+        requests_before = dict(self.upstream.requests)
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        latencies = []
+        errors = 0
+
+        async def one(n):
+            nonlocal errors
+            async with semaphore:
+                if self.args.cold:
+                    _clear_memory_caches()
+                current_command.set(command)
+                start = time.perf_counter()
+                try:
+                    await self.invoke(command, n)
+                except Exception as e:
+                    errors += 1
+                    print(f"{command} #{n} failed: {e!r}")
+                    return
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(n) for n in range(self.args.iterations)))
+        wall = time.perf_counter() - start
+
+        iterations = self.args.iterations
+        return {
+            "iterations": iterations,
+            "errors": errors,
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "p99_ms": _percentile(latencies, 99),
+            "throughput_per_s": len(latencies) / wall if wall else 0.0,
+            "upstream_requests": {
+                name: (self.upstream.requests[name] - requests_before.get(name, 0)) / iterations
+                for name in UPSTREAMS
+            },
+            "upstream_bytes": {
+                name: (self.upstream.bytes_sent[name] - bytes_before.get(name, 0)) / iterations
+                for name in UPSTREAMS
+            },
+        }
+
+
+def _print_results(results, baseline=None):
+    print(f"\n{'command':<8} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>8} {'calls':>7} {'KB/call':>9}")
+    for command, r in results.items():
+        calls = sum(r["upstream_requests"].values())
+        kb = sum(r["upstream_bytes"].values()) / 1024
+        line = (f"{command:<8} {r['p50_ms']:7.1f}ms {r['p95_ms']:7.1f}ms {r['p99_ms']:7.1f}ms "
+                f"{r['throughput_per_s']:8.1f} {calls:7.1f} {kb:9.1f}")
+        if r["errors"]:
+            line += f"  ({r['errors']} errors)"
+        before = (baseline or {}).get(command)
+        if before and before["p50_ms"]:
+            line += (f"  p50 {(r['p50_ms'] / before['p50_ms'] - 1) * 100:+.0f}%"
+                     f" p95 {(r['p95_ms'] / max(before['p95_ms'], 1e-9) - 1) * 100:+.0f}%")
+        print(line)
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="trakt-bench-")
+    db.DB_FILE = os.path.join(workdir, "bench.db")
+    poster_cache.cache_dir = os.path.join(workdir, "image_cache")
+    db.init_db()
+    user_registry.load()
+
+    if not args.real_limits:
+        # The benchmark measures the bot, not the upstream quotas
+        for limiter in (trakt_limiter, tmdb_limiter, image_limiter):
+            limiter.rate = limiter.capacity = limiter.tokens = 1_000_000
+
+    config = UpstreamConfig(latency_ms=args.latency, jitter_ms=args.jitter, history_length=args.history,
+                            watchlist_length=args.watchlist, poster_kb=args.poster_kb,
+                            trakt_images=not args.no_trakt_images)
+    async with FakeUpstream(config) as upstream:
+        trakt_api.TRAKT_BASE_URL = upstream.trakt_url
+        tmbd_api.TMDB_BASE_URL = upstream.tmdb_url
+        tmbd_api.TMDB_IMAGE_ROOT = upstream.image_url + "/t/p/"
+
+        bench = Bench(args, upstream)
+        await import_queue.start(None)
+        try:
+            print(f"Importing {len(bench.users)} users with {args.history} plays each...")
+            for author_id, username in bench.users:
+                user_registry.set(author_id, username)
+            await asyncio.gather(*(sync_history(username, full=True) for _, username in bench.users))
+
+            results = {}
+            for command in args.commands:
+                results[command] = await bench.run_command(command)
+                print(f"  {command}: done")
+        finally:
+            await import_queue.stop()
+            await user_registry.flush()
+            await close_session()
+            shutdown_render_pool()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", nargs="+", choices=COMMANDS, default=COMMANDS)
+    parser.add_argument("--iterations", type=int, default=50, help="invocations per command")
+    parser.add_argument("--concurrency", type=int, default=4, help="invocations in flight at once")
+    parser.add_argument("--users", type=int, default=4, help="registered users the invocations rotate through")
+    parser.add_argument("--latency", type=float, default=50, help="ms added to every upstream response")
+    parser.add_argument("--jitter", type=float, default=10, help="± ms of random latency")
+    parser.add_argument("--history", type=int, default=2000, help="plays per user")
+    parser.add_argument("--watchlist", type=int, default=12, help="watchlist items per user")
+    parser.add_argument("--poster-kb", type=int, default=0, help="pad posters to at least this many KB")
+    parser.add_argument("--no-trakt-images", action="store_true", help="make every poster go through TMDB search")
+    parser.add_argument("--cold", action="store_true", help="clear in-memory image caches before each invocation")
+    parser.add_argument("--real-limits", action="store_true", help="keep the production rate limits")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/commands-<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to show the change against")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    _print_results(results, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"commands-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"created": datetime.now().isoformat(timespec="seconds"),
+                   "config": vars(args), "results": results}, f, indent=2)
+    print(f"\nSaved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Local stand-ins for api.trakt.tv, api.themoviedb.org and the poster CDNs, for offline benchmarks.
+
+Every Trakt username exists and has a deterministic history of `history_length` plays
+(half episodes, half movies, newest first, one every few hours). Latency is added to
+every response and bytes sent are counted per server, so benchmarks can report both.
+"""
+import asyncio
+import random
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+from benchmarks.poster_sizes import _synthetic_poster
+
+MOVIE_TITLES = 300
+SHOW_TITLES = 120
+# Plays are spread this far apart, newest first
+PLAY_INTERVAL = timedelta(hours=3)
+GENRES = ["drama", "comedy", "action", "thriller", "science-fiction", "animation", "documentary", "horror"]
+
+
+class UpstreamConfig:
+    def __init__(self, latency_ms=50, jitter_ms=10, history_length=2000, watchlist_length=12,
+                 poster_kb=0, trakt_images=True):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.history_length = history_length
+        self.watchlist_length = watchlist_length
+        # Posters are padded up to at least this many KB (0 = natural JPEG size)
+        self.poster_kb = poster_kb
+        # Whether extended=images responses carry Trakt CDN poster URLs
+        self.trakt_images = trakt_images
+
+
+def _user_seed(username):
+    return zlib.crc32(username.encode("utf-8"))
+
+
+def _without_images(value):
+    if isinstance(value, dict) and "images" in value:
+        return {k: v for k, v in value.items() if k != "images"}
+    return value
+
+
+class FakeUpstream:
+    """Runs the three fake servers on localhost ports; use as an async context manager."""
+
+    def __init__(self, config):
+        self.config = config
+        self.bytes_sent = Counter()
+        self.requests = Counter()
+        self.trakt_url = self.tmdb_url = self.image_url = None
+        self._runners = []
+        self._posters = {}
+        self._histories = {}
+
+    # --- plumbing ---
+
+    def _middleware(self, name):
+        @web.middleware
+        async def middleware(request, handler):
+            delay = self.config.latency_ms + random.uniform(-1, 1) * self.config.jitter_ms
+            await asyncio.sleep(max(0, delay) / 1000)
+            response = await handler(request)
+            self.requests[name] += 1
+            self.bytes_sent[name] += len(response.body or b"")
+            return response
+        return middleware
+
+    async def _serve(self, name, routes):
+        app = web.Application(middlewares=[self._middleware(name)])
+        app.add_routes(routes)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        self._runners.append(runner)
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def __aenter__(self):
+        self.trakt_url = await self._serve("trakt", [
+            web.get("/users/{username}", self._trakt_user),
+            web.get("/users/{username}/history", self._trakt_history),
+            web.get("/users/{username}/history/{media_type}", self._trakt_history),
+            web.get("/users/{username}/watchlist", self._trakt_watchlist),
+        ])
+        self.tmdb_url = await self._serve("tmdb", [
+            web.get("/search/{media_type}", self._tmdb_search),
+            web.get("/{media_type:movie|tv}/{tmdb_id:\\d+}", self._tmdb_details),
+        ])
+        self.image_url = await self._serve("images", [
+            web.get("/t/p/{size}/{name}", self._tmdb_image),
+            web.get("/images/{kind}/{name}", self._trakt_image),
+        ])
+        return self
+
+    async def __aexit__(self, *exc):
+        for runner in self._runners:
+            await runner.cleanup()
+
+    # --- generated data ---
+
+    def _movie(self, n):
+        movie = {"title": f"Movie {n}", "year": 1980 + n % 45, "runtime": 80 + n % 70,
+                 "genres": GENRES[n % len(GENRES):][:2],
+                 "ids": {"trakt": n, "slug": f"movie-{n}", "tmdb": 100000 + n, "imdb": f"tt{1000000 + n}"}}
+        if self.config.trakt_images:
+            movie["images"] = {"poster": [f"{self.image_url}/images/movies/{n}.jpg"]}
+        return movie
+
+    def _show(self, n):
+        show = {"title": f"Show {n}", "year": 1990 + n % 35, "runtime": 25 + 20 * (n % 3),
+                "genres": GENRES[n % len(GENRES):][:2],
+                "ids": {"trakt": n, "slug": f"show-{n}", "tmdb": 200000 + n, "imdb": f"tt{2000000 + n}"}}
+        if self.config.trakt_images:
+            show["images"] = {"poster": [f"{self.image_url}/images/shows/{n}.jpg"]}
+        return show
+
+    def history(self, username, media_type=None):
+        """The full history of `username`, newest first, as Trakt would return it."""
+        if username not in self._histories:
+            self._histories[username] = self._generate_history(username)
+        entries = self._histories[username]
+        if media_type == "movies":
+            return [e for e in entries if e["type"] == "movie"]
+        if media_type in ("shows", "episodes"):
+            return [e for e in entries if e["type"] == "episode"]
+        return entries
+
+    def _generate_history(self, username):
+        seed = _user_seed(username)
+        rng = random.Random(seed)
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        entries = []
+        for i in range(self.config.history_length):
+            watched_at = (now - PLAY_INTERVAL * i).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            # History ids must be unique across users, like Trakt's
+            entry = {"id": seed * 1_000_000 + i, "watched_at": watched_at, "action": "watch"}
+            if i % 2:
+                entry.update(type="movie", movie=self._movie(int(rng.paretovariate(1.2)) % MOVIE_TITLES))
+            else:
+                show = int(rng.paretovariate(1.2)) % SHOW_TITLES
+                entry.update(type="episode", show=self._show(show), episode={
+                    "season": 1 + i % 5, "number": 1 + i % 12, "title": f"Episode {i}",
+                    "ids": {"trakt": seed * 1_000_000 + i}
+                })
+            entries.append(entry)
+        return entries
+
+    def _poster(self, width, seed):
+        key = (width, seed % 16)
+        if key not in self._posters:
+            data = _synthetic_poster(width, seed)
+            padding = self.config.poster_kb * 1024 - len(data)
+            # Bytes after the JPEG end marker are ignored by decoders
+            self._posters[key] = data + b"\0" * max(0, padding)
+        return self._posters[key]
+
+    # --- handlers ---
+
+    async def _trakt_user(self, request):
+        username = request.match_info["username"]
+        return web.json_response({"username": username, "private": False})
+
+    async def _trakt_history(self, request):
+        entries = self.history(request.match_info["username"], request.match_info.get("media_type"))
+        start_at = request.query.get("start_at")
+        if start_at:
+            entries = [e for e in entries if e["watched_at"] >= start_at]
+
+        page = int(request.query.get("page", 1))
+        limit = int(request.query.get("limit", 10))
+        page_count = max(1, -(-len(entries) // limit))
+        body = entries[(page - 1) * limit:page * limit]
+        if request.query.get("extended") != "images":
+            body = [{key: _without_images(value) for key, value in entry.items()} for entry in body]
+        return web.json_response(body, headers={
+            "X-Pagination-Page": str(page),
+            "X-Pagination-Limit": str(limit),
+            "X-Pagination-Page-Count": str(page_count),
+            "X-Pagination-Item-Count": str(len(entries)),
+        })
+
+    async def _trakt_watchlist(self, request):
+        rng = random.Random(_user_seed(request.match_info["username"]))
+        entries = []
+        for rank in range(self.config.watchlist_length):
+            if rank % 3:
+                entries.append({"rank": rank + 1, "type": "movie", "movie": self._movie(rng.randrange(MOVIE_TITLES))})
+            else:
+                entries.append({"rank": rank + 1, "type": "show", "show": self._show(rng.randrange(SHOW_TITLES))})
+        return web.json_response(entries)
+
+    async def _tmdb_search(self, request):
+        query = request.query.get("query", "")
+        media_type = request.match_info["media_type"]
+        tmdb_id = zlib.crc32(f"{media_type}:{query}".encode("utf-8")) % 1_000_000
+        return web.json_response({"page": 1, "total_results": 1, "results": [
+            {"id": tmdb_id, "poster_path": f"/{media_type}-{tmdb_id}.jpg"}
+        ]})
+
+    async def _tmdb_details(self, request):
+        media_type, tmdb_id = request.match_info["media_type"], int(request.match_info["tmdb_id"])
+        return web.json_response({"id": tmdb_id, "poster_path": f"/{media_type}-{tmdb_id}.jpg"})
+
+    async def _tmdb_image(self, request):
+        size = request.match_info["size"]
+        width = 2000 if size == "original" else int(size[1:])
+        seed = zlib.crc32(request.match_info["name"].encode("utf-8"))
+        return web.Response(body=self._poster(min(width, 780), seed), content_type="image/jpeg")
+
+    async def _trakt_image(self, request):
+        seed = zlib.crc32(request.match_info["name"].encode("utf-8"))
+        return web.Response(body=self._poster(300, seed), content_type="image/jpeg")
@@ -0,0 +1,80 @@
+"""
+Bytes transferred and decode time per grid tile: the old pipeline (TMDB w500, full decode)
+against size-aware fetching (smallest covering TMDB size) with draft-mode decoding.
+
+    python -m benchmarks.poster_sizes                    # synthetic posters, no network
+    python -m benchmarks.poster_sizes --poster-path /8Gxv8gSFCU0XGDykEGv7zR1n2ua.jpg
+"""
+import argparse
+import random
+import time
+import urllib.request
+from io import BytesIO
+
+from PIL import Image, ImageFilter
+
+from tmbd_api import TMDB_IMAGE_ROOT, tmdb_image_url
+from utils.poster_cache import _decode
+
+# (label, tile size) for the layouts the bot renders
+TILES = [
+    ("t6 fixed grid", (200, 300)),
+    ("watchlist 12 items", (173, 260)),
+    ("watchlist 4 items", (300, 450)),
+]
+REPEAT = 20
+
+
+def _synthetic_poster(width, seed=0):
+    """A noisy, blurred poster-like JPEG so compression behaves roughly like real artwork."""
+    height = int(width * 1.5)
+    rng = random.Random(seed)
+    small = Image.new("RGB", (max(1, width // 8), max(1, height // 8)))
+    small.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                   for _ in range(small.width * small.height)])
+    img = small.resize((width, height), Image.BICUBIC).filter(ImageFilter.GaussianBlur(1))
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _fetch(url):
+    with urllib.request.urlopen(url, timeout=10) as resp:
+        return resp.read()
+
+
+def _width_of(url):
+    size = url[len(TMDB_IMAGE_ROOT):].split("/", 1)[0]
+    return 2000 if size == "original" else int(size[1:])
+
+
+def _decode_and_resize(data, tile, draft):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        _decode(data, tile if draft else None).resize(tile)
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--poster-path", help="measure a real TMDB poster instead of synthetic ones")
+    args = parser.parse_args()
+
+    print(f"{'layout':<20} {'before':>22} {'after':>30}")
+    for label, tile in TILES:
+        before_url = f"{TMDB_IMAGE_ROOT}w500{args.poster_path or '/poster.jpg'}"
+        after_url = tmdb_image_url(args.poster_path or "/poster.jpg", tile[0])
+        if args.poster_path:
+            before, after = _fetch(before_url), _fetch(after_url)
+        else:
+            before, after = _synthetic_poster(500), _synthetic_poster(_width_of(after_url))
+
+        before_ms = _decode_and_resize(before, tile, draft=False)
+        after_ms = _decode_and_resize(after, tile, draft=True)
+        after_size = after_url[len(TMDB_IMAGE_ROOT):].split("/", 1)[0]
+        print(f"{label:<20} w500 {len(before) / 1024:7.1f} KB {before_ms:6.2f} ms"
+              f"   {after_size:>4} {len(after) / 1024:7.1f} KB {after_ms:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Time to build a !tyear recap from a large stored history: loading the rows into NumPy
+columns, aggregating them and rendering the image, each timed separately.
+
+The history is written straight into a temporary database (no network), with plays
+spread over `--years` years so the recap year holds its share of them.
+
+    python -m benchmarks.year_review
+    python -m benchmarks.year_review --plays 250000 --years 1
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import database.database as db
+from benchmarks.fake_upstream import FakeUpstream, UpstreamConfig
+from utils.analytics import load_history, year_in_review
+from utils.image_grid import create_year_in_review
+from utils.render_pool import shutdown_render_pool
+
+USERNAME = "bench-recap"
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+async def run(args):
+    db.DB_FILE = os.path.join(tempfile.mkdtemp(prefix="trakt-bench-"), "bench.db")
+    db.init_db()
+
+    # Squeeze the fake history into the requested span, ending now
+    upstream = FakeUpstream(UpstreamConfig(history_length=args.plays, trakt_images=False))
+    entries = upstream.history(USERNAME)
+    span = args.years * 365 * 24 * 60 * 60
+    now = int(time.time())
+    for index, entry in enumerate(entries):
+        ts = now - span * index // len(entries)
+        entry["watched_at"] = datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    _, ms = _timed(db.bulk_ingest_history, USERNAME, entries)
+    print(f"Stored {len(entries):,} plays over {args.years} years in {ms:.0f} ms")
+
+    # The whole history, not one year: the worst case for loading
+    since, until = 0, 2 ** 62
+    year = datetime.now(timezone.utc).year
+    load_ms, aggregate_ms, render_ms = [], [], []
+    for _ in range(args.iterations):
+        columns, ms = _timed(load_history, USERNAME, since, until)
+        load_ms.append(ms)
+        report, ms = _timed(year_in_review, columns, year)
+        aggregate_ms.append(ms)
+        start = time.perf_counter()
+        image = await create_year_in_review(report, f"{USERNAME}'s {year} in review")
+        render_ms.append((time.perf_counter() - start) * 1000)
+    shutdown_render_pool()
+
+    print(f"\n{len(columns):,} rows loaded, {report['plays']:,} in {year}, "
+          f"{len(columns.titles)} titles, image {image.getbuffer().nbytes / 1024:.0f} KB")
+    print(f"{'step':<10} {'median':>9} {'max':>9}")
+    totals = [sum(steps) for steps in zip(load_ms, aggregate_ms, render_ms)]
+    for name, times in [("load", load_ms), ("aggregate", aggregate_ms), ("render", render_ms), ("total", totals)]:
+        print(f"{name:<10} {statistics.median(times):7.1f}ms {max(times):7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plays", type=int, default=100_000, help="plays in the stored history")
+    parser.add_argument("--years", type=int, default=5, help="years the history is spread over")
+    parser.add_argument("--iterations", type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
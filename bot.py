@@ -5,9 +5,13 @@ from discord import app_commands
 import asyncio
 from dotenv import load_dotenv
 from database.database import init_db
+from utils.http import close_session
+from utils.render_pool import shutdown_render_pool
+from utils.user_registry import user_registry
 
 load_dotenv()
 init_db()
+user_registry.load()
 
 
 TOKEN = os.getenv("DISCORD_TOKEN")
@@ -28,13 +32,23 @@ initial_extensions = [
     "models.help",
     "models.recent6",
     "models.watchlist",
+    "models.collage",
+    "models.stats",
+    "models.user_stats",
+    "models.year_review",
+    "models.guild",
 ]
 
 async def main():
     async with bot:
         for ext in initial_extensions:
             await bot.load_extension(ext)
-        await bot.start(TOKEN)
+        try:
+            await bot.start(TOKEN)
+        finally:
+            await user_registry.flush()
+            await close_session()
+            shutdown_render_pool()
 
 asyncio.run(main())
 
@@ -1,11 +1,52 @@
+import json
+import os
 import sqlite3
+import threading
+import time
 
 DB_FILE = "trakt_history.db"
+# Pre-database user registry, imported once by migration 2
+LEGACY_USERS_FILE = "users.json"
+
+# Rows per executemany/transaction during bulk ingest
+INGEST_BATCH_SIZE = 5000
+# Pause between ingest transactions, in seconds, so writers waiting on the lock
+# (job progress, sync state, TMDB caches) get in before the next batch starts.
+# SQLite's busy handler retries at up to 50 ms intervals early on; shorter pauses miss it
+INGEST_BATCH_PAUSE = 0.05
+
+# How long resolved / unresolved TMDB lookups stay valid, in seconds
+TMDB_LOOKUP_TTL = 30 * 24 * 60 * 60
+TMDB_NEGATIVE_LOOKUP_TTL = 24 * 60 * 60
+
+_ingest_conn = None
+_ingest_lock = threading.Lock()
+
+def _connect(check_same_thread=True):
+    """Opens a connection with the pragmas every caller wants (WAL itself is persistent, set in init_db)."""
+    conn = sqlite3.connect(DB_FILE, timeout=30, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+def _get_ingest_connection():
+    """Long-lived connection used for bulk writes, in autocommit mode so batches manage their own transactions."""
+    global _ingest_conn
+    if _ingest_conn is None:
+        # Imports run in whichever worker thread asyncio.to_thread picks; _ingest_lock serialises use
+        conn = _connect(check_same_thread=False)
+        conn.isolation_level = None
+        conn.execute("PRAGMA cache_size = -16000")  # ~16 MB page cache
+        _ingest_conn = conn
+    return _ingest_conn
 
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = _connect()
     cursor = conn.cursor()
 
+    # WAL lets commands keep reading while an import is writing
+    cursor.execute("PRAGMA journal_mode = WAL")
+
     # Create table for shows
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS shows (
@@ -31,61 +72,920 @@ def init_db():
         )
     ''')
 
+    # Per-user high-water mark for incremental history syncs
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            username TEXT PRIMARY KEY,
+            last_synced_watched_at TEXT,
+            last_synced_history_id INTEGER,
+            last_full_sync_at INTEGER,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+
+    # Cache of TMDB title searches; poster_path is NULL for negative results
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tmdb_lookups (
+            media_type TEXT NOT NULL,
+            title_key TEXT NOT NULL,
+            year TEXT NOT NULL,
+            tmdb_id INTEGER,
+            poster_path TEXT,
+            fetched_at INTEGER NOT NULL,
+            PRIMARY KEY (media_type, title_key, year)
+        )
+    ''')
+
+    # Cache of TMDB posters by id, shared by every title that resolves to it
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tmdb_posters (
+            media_type TEXT NOT NULL,
+            tmdb_id INTEGER NOT NULL,
+            poster_path TEXT,
+            fetched_at INTEGER NOT NULL,
+            PRIMARY KEY (media_type, tmdb_id)
+        )
+    ''')
+
     conn.commit()
+    _migrate(conn)
     conn.close()
 
-def save_history_to_db(username, shows, movies):
-    conn = sqlite3.connect(DB_FILE)
+def _migration_1(cursor):
+    """Indexes for per-user lookups and maintained per-user play counters."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_shows_username_watched_at ON shows (username, watched_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movies_username_watched_at ON movies (username, watched_at)")
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_counters (
+            username TEXT PRIMARY KEY,
+            movie_count INTEGER NOT NULL DEFAULT 0,
+            show_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # Backfill from whatever history is already stored
+    cursor.execute('''
+        INSERT OR REPLACE INTO user_counters (username, movie_count, show_count)
+        SELECT username, SUM(movie_count), SUM(show_count) FROM (
+            SELECT username, COUNT(*) AS movie_count, 0 AS show_count FROM movies GROUP BY username
+            UNION ALL
+            SELECT username, 0, COUNT(*) FROM shows GROUP BY username
+        )
+        GROUP BY username
+    ''')
+
+def _migration_2(cursor):
+    """Moves the Discord id -> Trakt username registry from users.json into the database."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            discord_id TEXT PRIMARY KEY,
+            trakt_username TEXT NOT NULL,
+            linked_at INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_trakt_username ON users (trakt_username)")
+
+    if os.path.exists(LEGACY_USERS_FILE):
+        with open(LEGACY_USERS_FILE, "r") as f:
+            legacy_users = json.load(f)
+        now = int(time.time())
+        cursor.executemany(
+            "INSERT OR IGNORE INTO users (discord_id, trakt_username, linked_at) VALUES (?, ?, ?)",
+            [(str(discord_id), username, now) for discord_id, username in legacy_users.items()]
+        )
+
+def _migration_3(cursor):
+    """History import jobs, persisted so queued/running imports resume after a restart."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            username TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            channel_id INTEGER,
+            message_id INTEGER,
+            pages_fetched INTEGER NOT NULL DEFAULT 0,
+            rows_written INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+
+def _migration_4(cursor):
+    """External ids and metadata from extended=full history, so posters resolve by id and stats can use runtime."""
+    for column in ["show_trakt_id INTEGER", "tmdb_id INTEGER", "imdb_id TEXT", "year INTEGER",
+                   "runtime INTEGER", "genres TEXT"]:
+        cursor.execute(f"ALTER TABLE shows ADD COLUMN {column}")
+    for column in ["movie_trakt_id INTEGER", "tmdb_id INTEGER", "imdb_id TEXT", "runtime INTEGER", "genres TEXT"]:
+        cursor.execute(f"ALTER TABLE movies ADD COLUMN {column}")
+
+def _migration_5(cursor):
+    """Epoch-second play timestamps, indexed, for date-range and "latest per show" queries."""
+    for table in ["shows", "movies"]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN watched_ts INTEGER")
+        cursor.execute(f"UPDATE {table} SET watched_ts = CAST(strftime('%s', watched_at) AS INTEGER)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_username_watched_ts ON {table} (username, watched_ts)")
+    cursor.execute("ALTER TABLE shows ADD COLUMN episode_title TEXT")
+    # Covers MAX(watched_ts) per show title without touching the table
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_shows_username_title_watched_ts ON shows (username, title, watched_ts)"
+    )
+
+def _migration_6(cursor):
+    """Per-user rollups for the stats commands, kept current by the ingest transaction."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_title_stats (
+            username TEXT NOT NULL,
+            media_type TEXT NOT NULL,
+            title TEXT NOT NULL,
+            year_key INTEGER NOT NULL,
+            year INTEGER,
+            tmdb_id INTEGER,
+            plays INTEGER NOT NULL,
+            minutes INTEGER NOT NULL,
+            last_watched_ts INTEGER,
+            PRIMARY KEY (username, media_type, title, year_key)
+        )
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_title_stats_plays ON user_title_stats (username, media_type, plays)"
+    )
+    for table, key in [("user_month_stats", "month TEXT"), ("user_weekday_stats", "weekday INTEGER"),
+                       ("user_day_stats", "day INTEGER")]:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                username TEXT NOT NULL,
+                {key} NOT NULL,
+                plays INTEGER NOT NULL,
+                minutes INTEGER NOT NULL,
+                PRIMARY KEY (username, {key.split()[0]})
+            )
+        ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_day_stats_plays ON user_day_stats (username, plays)")
+
+    for table in ["shows", "movies"]:
+        _update_rollups(cursor, table, "1", ())
+
+def _migration_7(cursor):
+    """Users whose stored plays predate the id/metadata columns, backfilled once by their next full import."""
+    cursor.execute("CREATE TABLE IF NOT EXISTS metadata_backfill (username TEXT PRIMARY KEY)")
+    cursor.execute('''
+        INSERT OR IGNORE INTO metadata_backfill (username)
+        SELECT username FROM shows WHERE show_trakt_id IS NULL OR episode_title IS NULL
+        UNION
+        SELECT username FROM movies WHERE movie_trakt_id IS NULL
+    ''')
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+    _migration_6,
+    _migration_7,
+]
+
+def _migrate(conn):
     cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
 
-    # Save shows
-    for entry in shows:
-        show = entry.get("show", {})
-        episode = entry.get("episode", {})
-        try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO shows (username, title, season, episode, watched_at, trakt_id)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
+def _genres(item):
+    genres = item.get("genres")
+    return ",".join(genres) if genres else None
+
+def history_to_rows(username, entries):
+    """
+    Converts Trakt history entries (shows and movies mixed) into row tuples in one pass.
+    Returns (show_rows, movie_rows, failed) where failed is a list of (entry, reason).
+    Ids, runtime and genres are only present when the history was fetched with extended=full.
+    """
+    show_rows = []
+    movie_rows = []
+    failed = []
+
+    for entry in entries:
+        history_id = entry.get("id")
+        watched_at = entry.get("watched_at")
+        if history_id is None or not watched_at:
+            failed.append((entry, "missing history id or watched_at"))
+            continue
+
+        if "episode" in entry or "show" in entry:
+            show = entry.get("show") or {}
+            episode = entry.get("episode") or {}
+            ids = show.get("ids") or {}
+            show_rows.append((
                 username,
                 show.get("title"),
                 episode.get("season"),
                 episode.get("number"),
-                entry.get("watched_at"),
-                entry.get("id")
+                watched_at,
+                history_id,
+                ids.get("trakt"),
+                ids.get("tmdb"),
+                ids.get("imdb"),
+                show.get("year"),
+                episode.get("runtime") or show.get("runtime"),
+                _genres(show),
+                episode.get("title")
             ))
-        except Exception as e:
-            print(f"Error saving show: {e}")
-
-    # Save movies
-    for entry in movies:
-        movie = entry.get("movie", {})
-        try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO movies (username, title, year, watched_at, trakt_id)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
+        elif "movie" in entry:
+            movie = entry.get("movie") or {}
+            ids = movie.get("ids") or {}
+            movie_rows.append((
                 username,
                 movie.get("title"),
                 movie.get("year"),
-                entry.get("watched_at"),
-                entry.get("id")
+                watched_at,
+                history_id,
+                ids.get("trakt"),
+                ids.get("tmdb"),
+                ids.get("imdb"),
+                movie.get("runtime"),
+                _genres(movie)
             ))
-        except Exception as e:
-            print(f"Error saving movie: {e}")
+        else:
+            failed.append((entry, f"unsupported history type {entry.get('type')!r}"))
+
+    return show_rows, movie_rows, failed
+
+# History table -> (media_type, year_key) expressions used by the rollups.
+# Shows are counted per title, movies per title and year, like get_top_titles.
+_ROLLUP_KEYS = {
+    "shows": ("'show'", "0"),
+    "movies": ("'movie'", "COALESCE(year, 0)"),
+}
+
+def _update_rollups(conn, table, where, params):
+    """
+    Adds the plays of `table` matching `where` to the stats rollups. Callers make sure
+    each play is added exactly once: new rows right after their insert, in the same transaction.
+    """
+    media_type, year_key = _ROLLUP_KEYS[table]
+    plays = f"FROM {table} WHERE watched_ts IS NOT NULL AND ({where})"
+    conn.execute(f'''
+        INSERT INTO user_title_stats (username, media_type, title, year_key, year, tmdb_id, plays, minutes,
+                                      last_watched_ts)
+        SELECT username, {media_type}, COALESCE(title, 'Unknown'), {year_key}, MAX(year), MAX(tmdb_id),
+               COUNT(*), SUM(COALESCE(runtime, 0)), MAX(watched_ts)
+        {plays}
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (username, media_type, title, year_key) DO UPDATE SET
+            year = COALESCE(excluded.year, year),
+            tmdb_id = COALESCE(excluded.tmdb_id, tmdb_id),
+            plays = plays + excluded.plays,
+            minutes = minutes + excluded.minutes,
+            last_watched_ts = MAX(last_watched_ts, excluded.last_watched_ts)
+    ''', params)
+    for rollup, key, expression in [
+        ("user_month_stats", "month", "strftime('%Y-%m', watched_ts, 'unixepoch')"),
+        ("user_weekday_stats", "weekday", "CAST(strftime('%w', watched_ts, 'unixepoch') AS INTEGER)"),
+        ("user_day_stats", "day", "watched_ts / 86400"),
+    ]:
+        conn.execute(f'''
+            INSERT INTO {rollup} (username, {key}, plays, minutes)
+            SELECT username, {expression}, COUNT(*), SUM(COALESCE(runtime, 0))
+            {plays}
+            GROUP BY 1, 2
+            ON CONFLICT (username, {key}) DO UPDATE SET
+                plays = plays + excluded.plays,
+                minutes = minutes + excluded.minutes
+        ''', params)
+
+def _rebuild_rollups(conn, username):
+    """Recomputes one user's rollups from scratch, after their stored plays were changed in place."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for rollup in ["user_title_stats", "user_month_stats", "user_weekday_stats", "user_day_stats"]:
+            conn.execute(f"DELETE FROM {rollup} WHERE username = ?", (username,))
+        for table in ["shows", "movies"]:
+            _update_rollups(conn, table, "username = ?", (username,))
+        conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        print(f"Error rebuilding stats for {username}: {e}")
+
+def _insert_batches(conn, table, sql, rows, batch_size, failed, username, counter_column, on_batch=None):
+    """
+    Inserts rows batch by batch. The user's play counter and stats rollups are updated
+    with the new rows inside the same transaction, so they can never drift from the table.
+    """
+    inserted = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            last_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+            before = conn.total_changes
+            conn.executemany(sql, batch)
+            added = conn.total_changes - before
+            if added:
+                conn.execute(f'''
+                    INSERT INTO user_counters (username, {counter_column}) VALUES (?, ?)
+                    ON CONFLICT(username) DO UPDATE SET {counter_column} = {counter_column} + excluded.{counter_column}
+                ''', (username, added))
+                # AUTOINCREMENT ids only grow, and BEGIN IMMEDIATE keeps other writers out,
+                # so the new plays are exactly the rows past last_id
+                _update_rollups(conn, table, "id > ?", (last_id,))
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            # Report the whole batch; sync_history keeps its high-water mark so the next sync retries it
+            failed.extend((row, f"batch insert failed: {e}") for row in batch)
+            continue
+        inserted += added
+        if on_batch:
+            on_batch(added)
+        time.sleep(INGEST_BATCH_PAUSE)
+    return inserted
+
+def _backfill_metadata(conn, sql, rows, batch_size):
+    """Runs the UPDATEs batch by batch. Returns (rows changed, whether every batch committed)."""
+    updated = 0
+    for start in range(0, len(rows), batch_size):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(sql, rows[start:start + batch_size])
+            updated += conn.total_changes - before
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"Error backfilling history metadata: {e}")
+            return updated, False
+        time.sleep(INGEST_BATCH_PAUSE)
+    return updated, True
+
+def bulk_ingest_history(username, entries, batch_size=INGEST_BATCH_SIZE, on_batch=None, full=False):
+    """
+    Writes Trakt history entries with executemany in batched transactions.
+    Already-stored plays are ignored. Returns (inserted, failed), where failed lists
+    (row, reason) for the rows of rolled-back batches; entries that can never be stored
+    (no id, no watched_at, unknown type) are logged and skipped.
+    `on_batch(rows)` is called after each committed batch with the number of new plays it stored
+    (duplicates and rolled-back batches don't count).
+    Pass full=True when `entries` is the user's whole history, so plays stored before ids
+    were kept can get their metadata filled in.
+    """
+    show_rows, movie_rows, skipped = history_to_rows(username, entries)
+    if skipped:
+        print(f"Skipping {len(skipped)} history entries for {username}, first: {skipped[0][1]}")
+    failed = []
+
+    with _ingest_lock:
+        conn = _get_ingest_connection()
+        shows_inserted = _insert_batches(conn, "shows", '''
+            INSERT OR IGNORE INTO shows (username, title, season, episode, watched_at, trakt_id,
+                                         show_trakt_id, tmdb_id, imdb_id, year, runtime, genres, episode_title,
+                                         watched_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CAST(strftime('%s', ?5) AS INTEGER))
+        ''', show_rows, batch_size, failed, username, "show_count", on_batch)
+        movies_inserted = _insert_batches(conn, "movies", '''
+            INSERT OR IGNORE INTO movies (username, title, year, watched_at, trakt_id,
+                                          movie_trakt_id, tmdb_id, imdb_id, runtime, genres, watched_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CAST(strftime('%s', ?4) AS INTEGER))
+        ''', movie_rows, batch_size, failed, username, "movie_count", on_batch)
+
+        # Plays stored before ids were kept are skipped by the inserts; the first full import
+        # after migration 7 fills their metadata in, then the user's marker is cleared
+        if full and _needs_metadata_backfill(conn, username):
+            shows_updated, shows_ok = _backfill_metadata(conn, '''
+                UPDATE shows SET show_trakt_id = ?, tmdb_id = ?, imdb_id = ?, year = ?, runtime = ?, genres = ?,
+                                 episode_title = ?
+                WHERE trakt_id = ? AND (show_trakt_id IS NULL OR episode_title IS NULL)
+            ''', [row[6:] + (row[5],) for row in show_rows if row[6] is not None], batch_size)
+            movies_updated, movies_ok = _backfill_metadata(conn, '''
+                UPDATE movies SET movie_trakt_id = ?, tmdb_id = ?, imdb_id = ?, runtime = ?, genres = ?
+                WHERE trakt_id = ? AND movie_trakt_id IS NULL
+            ''', [row[5:] + (row[4],) for row in movie_rows if row[5] is not None], batch_size)
+            if shows_updated or movies_updated:
+                # Runtimes and tmdb ids changed under the rollups
+                _rebuild_rollups(conn, username)
+            if shows_ok and movies_ok:
+                conn.execute("DELETE FROM metadata_backfill WHERE username = ?", (username,))
+        inserted = shows_inserted + movies_inserted
+
+    if failed:
+        print(f"Error saving {len(failed)} history rows for {username}, first: {failed[0][1]}")
+
+    return inserted, failed
+
+def _needs_metadata_backfill(conn, username):
+    return conn.execute("SELECT 1 FROM metadata_backfill WHERE username = ?", (username,)).fetchone() is not None
+
+def save_history_to_db(username, shows, movies):
+    return bulk_ingest_history(username, list(shows) + list(movies))
+
+def count_total_scrobbles(username):
+    conn = _connect()
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT movie_count, show_count FROM user_counters WHERE username = ?", (username,))
+    row = cursor.fetchone()
+
+    conn.close()
+    return (row[0], row[1]) if row else (0, 0)
+
+def get_top_titles(username, media_type=None, since=None, limit=9):
+    """
+    Returns the user's most played titles as [(media_type, title, year, plays, tmdb_id)], most played first.
+    media_type is "movies", "shows" or None for both; since is a lower bound in epoch seconds.
+    tmdb_id is None for plays stored before ids were kept.
+    """
+    since = since or 0
+    queries = []
+    params = []
+    if media_type in (None, "movies"):
+        queries.append('''
+            SELECT 'movie' AS media_type, title, year, COUNT(*) AS plays, MAX(tmdb_id) AS tmdb_id,
+                   MAX(watched_at) AS last_watched
+            FROM movies WHERE username = ? AND watched_ts >= ?
+            GROUP BY title, year
+        ''')
+        params += [username, since]
+    if media_type in (None, "shows"):
+        queries.append('''
+            SELECT 'show' AS media_type, title, MAX(year) AS year, COUNT(*) AS plays, MAX(tmdb_id) AS tmdb_id,
+                   MAX(watched_at) AS last_watched
+            FROM shows WHERE username = ? AND watched_ts >= ?
+            GROUP BY title
+        ''')
+        params += [username, since]
+
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT media_type, title, year, plays, tmdb_id FROM ({' UNION ALL '.join(queries)}) "
+        "ORDER BY plays DESC, last_watched DESC LIMIT ?",
+        params + [limit]
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_latest_play(username):
+    """
+    Returns the user's newest stored play as a dict (media_type "movie" or "show", title, year,
+    season, episode, episode_title, watched_at, tmdb_id), or None if nothing is stored.
+    """
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT * FROM (
+            SELECT * FROM (
+                SELECT 'show' AS media_type, title, year, season, episode, episode_title, watched_at, watched_ts, tmdb_id
+                FROM shows WHERE username = ? ORDER BY watched_ts DESC LIMIT 1
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT 'movie', title, year, NULL, NULL, NULL, watched_at, watched_ts, tmdb_id
+                FROM movies WHERE username = ? ORDER BY watched_ts DESC LIMIT 1
+            )
+        )
+        ORDER BY watched_ts DESC LIMIT 1
+    ''', (username, username))
+    row = cursor.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def get_latest_shows(username, limit=6):
+    """
+    Returns the `limit` most recently watched distinct shows as [(title, year, tmdb_id, last_watched_ts)],
+    newest first, however many episodes were watched in between.
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    # The inner query only reads idx_shows_username_title_watched_ts. CROSS JOIN keeps `latest`
+    # as the outer loop, so the join-back is one (username, title, watched_ts) index probe per
+    # returned row; with a plain JOIN the planner scanned all of the user's shows instead
+    cursor.execute('''
+        SELECT latest.title, MAX(s.year), MAX(s.tmdb_id), latest.last_watched
+        FROM (
+            SELECT title, MAX(watched_ts) AS last_watched FROM shows
+            WHERE username = ?
+            GROUP BY title
+            ORDER BY last_watched DESC
+            LIMIT ?
+        ) AS latest
+        CROSS JOIN shows s ON s.username = ? AND s.title = latest.title AND s.watched_ts = latest.last_watched
+        GROUP BY latest.title
+        ORDER BY latest.last_watched DESC
+    ''', (username, limit, username))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_latest_movies(username, limit=6):
+    """
+    Returns the `limit` most recent movie plays as [(title, year, tmdb_id, watched_ts)], newest first.
+    A rewatched movie shows up once per play, like in the Trakt history.
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT title, year, tmdb_id, watched_ts FROM movies
+        WHERE username = ?
+        ORDER BY watched_ts DESC
+        LIMIT ?
+    ''', (username, limit))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_plays_per_day(username, since, until=None, media_type="shows"):
+    """
+    Returns [(day, plays)] for days in [since, until) (epoch seconds), oldest first, with day
+    as "YYYY-MM-DD" in UTC. media_type is "shows" (episodes), "movies" or None for both.
+    Days without plays are left out.
+    """
+    until = until if until is not None else 2 ** 62
+    tables = ["shows", "movies"] if media_type is None else [media_type]
+    union = " UNION ALL ".join(
+        f"SELECT watched_ts FROM {table} WHERE username = ? AND watched_ts >= ? AND watched_ts < ?"
+        for table in tables
+    )
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT date(watched_ts, 'unixepoch') AS day, COUNT(*) FROM ({union})
+        GROUP BY day ORDER BY day
+    ''', [value for _ in tables for value in (username, since, until)])
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_user_stats(username, top=5, months=12):
+    """
+    Returns the user's all-time stats from the rollup tables as a dict:
+    plays and minutes per media type, top shows and movies as [(title, year, plays, minutes, tmdb_id)],
+    the last `months` months as [("YYYY-MM", plays, minutes)], plays per weekday (0 = Sunday),
+    the longest run of consecutive days with plays as (days, first_day, last_day) and the
+    biggest single day as ("YYYY-MM-DD", plays). Days are UTC.
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+
+    totals = {"show": (0, 0), "movie": (0, 0)}
+    cursor.execute('''
+        SELECT media_type, SUM(plays), SUM(minutes) FROM user_title_stats
+        WHERE username = ? GROUP BY media_type
+    ''', (username,))
+    for media_type, plays, minutes in cursor.fetchall():
+        totals[media_type] = (plays, minutes)
+
+    top_titles = {}
+    for media_type in ["show", "movie"]:
+        cursor.execute('''
+            SELECT title, year, plays, minutes, tmdb_id FROM user_title_stats
+            WHERE username = ? AND media_type = ?
+            ORDER BY plays DESC, last_watched_ts DESC LIMIT ?
+        ''', (username, media_type, top))
+        top_titles[media_type] = cursor.fetchall()
+
+    cursor.execute('''
+        SELECT month, plays, minutes FROM user_month_stats
+        WHERE username = ? ORDER BY month DESC LIMIT ?
+    ''', (username, months))
+    per_month = cursor.fetchall()[::-1]
+
+    cursor.execute("SELECT weekday, plays FROM user_weekday_stats WHERE username = ?", (username,))
+    per_weekday = dict(cursor.fetchall())
+
+    # Gaps and islands: day - row_number is constant along a run of consecutive days
+    cursor.execute('''
+        SELECT COUNT(*) AS days, MIN(day), MAX(day) FROM (
+            SELECT day, day - ROW_NUMBER() OVER (ORDER BY day) AS island
+            FROM user_day_stats WHERE username = ?
+        )
+        GROUP BY island ORDER BY days DESC, MAX(day) DESC LIMIT 1
+    ''', (username,))
+    streak = cursor.fetchone()
+
+    cursor.execute('''
+        SELECT day, plays FROM user_day_stats
+        WHERE username = ? ORDER BY plays DESC, day DESC LIMIT 1
+    ''', (username,))
+    best_day = cursor.fetchone()
+    conn.close()
+
+    def day_str(day):
+        return time.strftime("%Y-%m-%d", time.gmtime(day * 86400))
+
+    return {
+        "shows": totals["show"],
+        "movies": totals["movie"],
+        "top_shows": top_titles["show"],
+        "top_movies": top_titles["movie"],
+        "per_month": per_month,
+        "per_weekday": [per_weekday.get(weekday, 0) for weekday in range(7)],
+        "longest_streak": (streak[0], day_str(streak[1]), day_str(streak[2])) if streak else None,
+        "best_day": (day_str(best_day[0]), best_day[1]) if best_day else None,
+    }
+
+def get_play_columns(username, since, until):
+    """
+    Returns every play in [since, until) (epoch seconds) grouped by title, for bulk analytics:
+    [(is_movie, title, genres, plays, packed)] where `packed` is "watched_ts:runtime,..." with
+    one pair per play (runtime 0 when unknown). Each pair comes from a single group_concat, so
+    timestamps and runtimes can't get out of step whatever order SQLite aggregates in.
+    A few hundred rows instead of one Python tuple per play; see utils/analytics.py.
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT 0, title, genres, COUNT(*), group_concat(watched_ts || ':' || COALESCE(runtime, 0))
+        FROM shows WHERE username = ? AND watched_ts >= ? AND watched_ts < ?
+        GROUP BY title, genres
+        UNION ALL
+        SELECT 1, title, genres, COUNT(*), group_concat(watched_ts || ':' || COALESCE(runtime, 0))
+        FROM movies WHERE username = ? AND watched_ts >= ? AND watched_ts < ?
+        GROUP BY title, genres
+    ''', (username, since, until, username, since, until))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def _guild_plays(columns):
+    """Plays of a list of users (a JSON array bound as the first two parameters) since a timestamp (the others)."""
+    return f'''
+        SELECT 'show' AS media_type, {columns} FROM shows
+        WHERE username IN (SELECT value FROM json_each(?)) AND watched_ts >= ?
+        UNION ALL
+        SELECT 'movie' AS media_type, {columns} FROM movies
+        WHERE username IN (SELECT value FROM json_each(?)) AND watched_ts >= ?
+    '''
+
+def get_guild_leaderboard(usernames, since, limit=10):
+    """
+    Ranks `usernames` by watch time since `since` (epoch seconds) in one aggregation:
+    [(username, episodes, movies, minutes)], most minutes first. Users without plays are left out.
+    """
+    members = json.dumps(list(usernames))
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT username,
+               SUM(media_type = 'show') AS episodes,
+               SUM(media_type = 'movie') AS movies,
+               SUM(COALESCE(runtime, 0)) AS minutes
+        FROM ({_guild_plays("username, runtime")})
+        GROUP BY username
+        ORDER BY minutes DESC, episodes + movies DESC
+        LIMIT ?
+    ''', (members, since, members, since, limit))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_guild_trending(usernames, since, limit=10):
+    """
+    Titles watched by the most of `usernames` since `since`:
+    [(media_type, title, year, watchers, plays, tmdb_id)], most watchers first, then most plays.
+    """
+    members = json.dumps(list(usernames))
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT media_type, title, MAX(year), COUNT(DISTINCT username) AS watchers, COUNT(*) AS plays,
+               MAX(tmdb_id)
+        FROM ({_guild_plays("username, title, year, tmdb_id")})
+        GROUP BY media_type, title
+        ORDER BY watchers DESC, plays DESC
+        LIMIT ?
+    ''', (members, since, members, since, limit))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_guild_recent_titles(usernames, since, limit=9):
+    """
+    The most recently watched distinct titles across `usernames` since `since`:
+    [(media_type, title, year, tmdb_id, last_watched_ts)], newest first.
+    """
+    members = json.dumps(list(usernames))
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT media_type, title, MAX(year), MAX(tmdb_id), MAX(watched_ts) AS last_watched
+        FROM ({_guild_plays("title, year, tmdb_id, watched_ts")})
+        GROUP BY media_type, title
+        ORDER BY last_watched DESC
+        LIMIT ?
+    ''', (members, since, members, since, limit))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def load_registered_users():
+    """Returns the whole registry as {discord_id: trakt_username}."""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT discord_id, trakt_username FROM users")
+    users = dict(cursor.fetchall())
+    conn.close()
+    return users
+
+def save_registered_users(users):
+    """Upserts {discord_id: trakt_username} pairs in one transaction."""
+    now = int(time.time())
+    conn = _connect()
+    with conn:
+        conn.executemany('''
+            INSERT INTO users (discord_id, trakt_username, linked_at) VALUES (?, ?, ?)
+            ON CONFLICT(discord_id) DO UPDATE SET
+                trakt_username = excluded.trakt_username,
+                linked_at = excluded.linked_at
+        ''', [(discord_id, username, now) for discord_id, username in users.items()])
+    conn.close()
+
+def save_import_job(username, channel_id, message_id):
+    """Queues (or re-queues) an import job for `username`."""
+    now = int(time.time())
+    conn = _connect()
+    with conn:
+        conn.execute('''
+            INSERT INTO import_jobs (username, status, channel_id, message_id, created_at, updated_at)
+            VALUES (?, 'queued', ?, ?, ?, ?)
+            ON CONFLICT(username) DO UPDATE SET
+                status = 'queued',
+                channel_id = excluded.channel_id,
+                message_id = excluded.message_id,
+                pages_fetched = 0,
+                rows_written = 0,
+                created_at = excluded.created_at,
+                updated_at = excluded.updated_at
+        ''', (username, channel_id, message_id, now, now))
+    conn.close()
+
+def update_import_job(username, status, pages_fetched, rows_written):
+    conn = _connect()
+    with conn:
+        conn.execute('''
+            UPDATE import_jobs SET status = ?, pages_fetched = ?, rows_written = ?, updated_at = ?
+            WHERE username = ?
+        ''', (status, pages_fetched, rows_written, int(time.time()), username))
+    conn.close()
+
+def get_unfinished_import_jobs():
+    """Returns [(username, channel_id, message_id)] for jobs that were queued or running, oldest first."""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT username, channel_id, message_id FROM import_jobs
+        WHERE status IN ('queued', 'running')
+        ORDER BY created_at
+    ''')
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_metadata_backfill_usernames():
+    """Users still marked by migration 7: their next full import fills in ids and metadata."""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT username FROM metadata_backfill ORDER BY username")
+    usernames = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return usernames
 
+def get_sync_state(username):
+    """Returns (last_synced_watched_at, last_synced_history_id), or None if the user was never synced."""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT last_synced_watched_at, last_synced_history_id FROM sync_state WHERE username = ?",
+        (username,)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+def get_latest_stored_play(username):
+    """
+    Returns (watched_at, trakt_id) of the newest play stored for a user, or None.
+    Used to seed the sync state for users imported before it existed.
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT watched_at, trakt_id FROM (
+            SELECT watched_at, trakt_id FROM shows WHERE username = ?
+            UNION ALL
+            SELECT watched_at, trakt_id FROM movies WHERE username = ?
+        )
+        ORDER BY watched_at DESC
+        LIMIT 1
+    ''', (username, username))
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+def save_sync_state(username, watched_at, history_id, full_sync=False):
+    now = int(time.time())
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO sync_state (username, last_synced_watched_at, last_synced_history_id, last_full_sync_at, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(username) DO UPDATE SET
+            last_synced_watched_at = excluded.last_synced_watched_at,
+            last_synced_history_id = excluded.last_synced_history_id,
+            last_full_sync_at = COALESCE(excluded.last_full_sync_at, sync_state.last_full_sync_at),
+            updated_at = excluded.updated_at
+    ''', (username, watched_at, history_id, now if full_sync else None, now))
     conn.commit()
     conn.close()
 
-def count_total_scrobbles(username):
-    conn = sqlite3.connect(DB_FILE)
+def _lookup_key(title, year):
+    title_key = " ".join(str(title or "").lower().split())
+    year_key = str(year) if isinstance(year, int) or str(year).isdigit() else ""
+    return title_key, year_key
+
+def _is_fresh(poster_path, fetched_at, now):
+    ttl = TMDB_LOOKUP_TTL if poster_path else TMDB_NEGATIVE_LOOKUP_TTL
+    return now - fetched_at < ttl
+
+def get_cached_tmdb_lookup(media_type, title, year):
+    """
+    Returns (hit, poster_path) for a previous TMDB search.
+    A hit with poster_path None is a cached negative result.
+    """
+    title_key, year_key = _lookup_key(title, year)
+    conn = _connect()
     cursor = conn.cursor()
 
-    cursor.execute("SELECT COUNT(*) FROM movies WHERE username = ?", (username,))
-    movie_count = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT
+            CASE WHEN p.tmdb_id IS NULL THEN l.poster_path ELSE p.poster_path END,
+            CASE WHEN p.tmdb_id IS NULL THEN l.fetched_at ELSE p.fetched_at END
+        FROM tmdb_lookups l
+        LEFT JOIN tmdb_posters p ON p.media_type = l.media_type AND p.tmdb_id = l.tmdb_id
+        WHERE l.media_type = ? AND l.title_key = ? AND l.year = ?
+    ''', (media_type, title_key, year_key))
+    row = cursor.fetchone()
+    conn.close()
+
+    if row is None or not _is_fresh(row[0], row[1], int(time.time())):
+        return False, None
+    return True, row[0]
+
+def save_tmdb_lookup(media_type, title, year, tmdb_id, poster_path):
+    title_key, year_key = _lookup_key(title, year)
+    now = int(time.time())
+    conn = _connect()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        INSERT OR REPLACE INTO tmdb_lookups (media_type, title_key, year, tmdb_id, poster_path, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (media_type, title_key, year_key, tmdb_id, poster_path, now))
+
+    if tmdb_id is not None:
+        cursor.execute('''
+            INSERT OR REPLACE INTO tmdb_posters (media_type, tmdb_id, poster_path, fetched_at)
+            VALUES (?, ?, ?, ?)
+        ''', (media_type, tmdb_id, poster_path, now))
+
+    conn.commit()
+    conn.close()
+
+def get_cached_tmdb_posters(media_type, tmdb_ids):
+    """
+    Returns {tmdb_id: poster_path} for the ids with a fresh cached poster lookup, in one query.
+    A poster_path of None is a cached "TMDB has no poster".
+    """
+    tmdb_ids = list(set(tmdb_ids))
+    if not tmdb_ids:
+        return {}
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT tmdb_id, poster_path, fetched_at FROM tmdb_posters
+        WHERE media_type = ? AND tmdb_id IN ({", ".join("?" * len(tmdb_ids))})
+    ''', [media_type] + tmdb_ids)
+    rows = cursor.fetchall()
+    conn.close()
 
-    cursor.execute("SELECT COUNT(*) FROM shows WHERE username = ?", (username,))
-    show_count = cursor.fetchone()[0]
+    now = int(time.time())
+    return {tmdb_id: poster_path for tmdb_id, poster_path, fetched_at in rows
+            if _is_fresh(poster_path, fetched_at, now)}
 
+def save_tmdb_posters(media_type, posters):
+    """Stores {tmdb_id: poster_path} results of by-id lookups in one transaction."""
+    now = int(time.time())
+    conn = _connect()
+    with conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO tmdb_posters (media_type, tmdb_id, poster_path, fetched_at)
+            VALUES (?, ?, ?, ?)
+        ''', [(media_type, tmdb_id, poster_path, now) for tmdb_id, poster_path in posters.items()])
     conn.close()
-    return movie_count, show_count
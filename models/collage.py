@@ -0,0 +1,100 @@
+import discord
+from discord.ext import commands
+
+from database.database import get_top_titles
+from tmbd_api import get_tmdb_posters
+from utils.display import FALLBACK_POSTER, PERIODS, period_since
+from utils.image_grid import create_collage, collage_render_stats
+from utils.metrics import metrics
+from utils.trakt_utils import refresh_history
+from utils.user_registry import user_registry
+
+COLLAGE_TILE_WIDTH = 180
+COLLAGE_TILE_HEIGHT = 270
+DEFAULT_PERIOD = "1m"
+MEDIA_TYPES = {"movies": "movies", "shows": "shows", "all": None}
+
+
+async def _resolve_posters(rows):
+    posters = await get_tmdb_posters([
+        ("movie" if media_type == "movie" else "tv", tmdb_id, title, year)
+        for media_type, title, year, _, tmdb_id in rows
+    ])
+    return [poster or FALLBACK_POSTER for poster in posters]
+
+
+class CollageCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def send_collage(self, ctx, size, period, media):
+        username = user_registry.get(ctx.author.id)
+
+        if username is None:
+            embed = discord.Embed(
+                title="📌 Trakt Account Not Registered",
+                description=(
+                    "You haven't linked your Trakt account yet.\n\n"
+                    "**Register:** Use `tset <username>` to link your account.\n"
+                    "**Need an account?** [Sign up here](https://trakt.tv/signup)"
+                ),
+                color=discord.Color.red()
+            )
+            await ctx.send(embed=embed)
+            return
+
+        period = period.lower()
+        media = media.lower()
+        if period not in PERIODS or media not in MEDIA_TYPES:
+            await ctx.send(
+                f"❌ Usage: `{ctx.prefix}{ctx.invoked_with} [{'|'.join(PERIODS)}] [{'|'.join(MEDIA_TYPES)}]`"
+            )
+            return
+
+        await refresh_history(username)
+        rows = get_top_titles(username, MEDIA_TYPES[media], period_since(period), limit=size * size)
+
+        if not rows:
+            await ctx.send("❌ Nothing watched in that period.")
+            return
+
+        posters = await _resolve_posters(rows)
+        image_data = [(poster, row[1]) for poster, row in zip(posters, rows)]
+        image_bytes, elapsed = await create_collage(
+            image_data, size, size, COLLAGE_TILE_WIDTH, COLLAGE_TILE_HEIGHT
+        )
+
+        plays = sum(row[3] for row in rows)
+        embed = discord.Embed(
+            title=f"🗂️ {ctx.author.display_name}'s top {size}x{size} ({period}, {media})",
+            color=0x2F3136,
+            url=f"https://trakt.tv/users/{username}"
+        )
+        embed.set_image(url="attachment://collage.webp")
+        renders, avg_ms, _ = collage_render_stats().get(f"{size}x{size}", (0, 0, 0))
+        embed.set_footer(
+            text=f"📊 {plays} plays | ⏱️ {elapsed * 1000:.0f} ms (avg {avg_ms:.0f} ms over {renders})"
+        )
+
+        file = discord.File(image_bytes, filename="collage.webp")
+        with metrics.phase("discord_send"):
+            await ctx.send(embed=embed, file=file)
+
+    @commands.command(name="t9")
+    async def trakt_collage_9(self, ctx, period=DEFAULT_PERIOD, media="all"):
+        """Show your top 9 titles for a period as a 3x3 collage"""
+        await self.send_collage(ctx, 3, period, media)
+
+    @commands.command(name="t16")
+    async def trakt_collage_16(self, ctx, period=DEFAULT_PERIOD, media="all"):
+        """Show your top 16 titles for a period as a 4x4 collage"""
+        await self.send_collage(ctx, 4, period, media)
+
+    @commands.command(name="t25")
+    async def trakt_collage_25(self, ctx, period=DEFAULT_PERIOD, media="all"):
+        """Show your top 25 titles for a period as a 5x5 collage"""
+        await self.send_collage(ctx, 5, period, media)
+
+
+async def setup(bot):
+    await bot.add_cog(CollageCog(bot))
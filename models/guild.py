@@ -0,0 +1,168 @@
+import discord
+from discord.ext import commands
+import time
+
+from database.database import get_guild_leaderboard, get_guild_recent_titles, get_guild_trending
+from tmbd_api import get_tmdb_posters
+from utils.display import FALLBACK_POSTER, PERIODS, format_hours, period_since
+from utils.image_grid import create_collage
+from utils.metrics import metrics
+from utils.trakt_utils import refresh_histories
+from utils.user_registry import user_registry
+
+COLLAGE_TILE_WIDTH = 180
+COLLAGE_TILE_HEIGHT = 270
+DEFAULT_PERIOD = "7d"
+LEADERBOARD_SIZE = 10
+TRENDING_SIZE = 10
+# query_members accepts at most 100 ids per request
+MEMBER_QUERY_CHUNK = 100
+# Without the members intent, how long a guild's looked-up member index is trusted
+MEMBER_INDEX_TTL = 30 * 60
+
+# guild id -> {"built_at", "checked": registered ids already looked up, "members": {id: member}}
+_member_index = {}
+
+
+async def _registered_members(guild, use_cache):
+    """
+    {trakt_username: member} for the guild members who linked an account.
+
+    With the members intent (`use_cache`) the member cache is complete and read as-is.
+    Without it, each guild keeps an index of the registered ids already looked up; only
+    ids registered since then are queried over the gateway, and the whole index is
+    refreshed every MEMBER_INDEX_TTL seconds to notice members who joined or left.
+    """
+    registered = {int(discord_id): username for discord_id, username in user_registry.items()}
+    if use_cache:
+        return {registered[member.id]: member for member in guild.members if member.id in registered}
+
+    now = time.monotonic()
+    index = _member_index.get(guild.id)
+    if index is None or now - index["built_at"] > MEMBER_INDEX_TTL:
+        index = _member_index[guild.id] = {"built_at": now, "checked": set(), "members": {}}
+
+    unchecked = [discord_id for discord_id in registered if discord_id not in index["checked"]]
+    for start in range(0, len(unchecked), MEMBER_QUERY_CHUNK):
+        chunk = unchecked[start:start + MEMBER_QUERY_CHUNK]
+        for member in await guild.query_members(user_ids=chunk, limit=len(chunk), cache=True):
+            index["members"][member.id] = member
+        index["checked"].update(chunk)
+
+    return {
+        registered[discord_id]: member for discord_id, member in index["members"].items()
+        if discord_id in registered
+    }
+
+
+class GuildCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def _prepare(self, ctx, period):
+        """Validates the period, finds the registered members and syncs them. Returns members or None."""
+        period = period.lower()
+        if period not in PERIODS:
+            await ctx.send(f"❌ Usage: `{ctx.prefix}{ctx.invoked_with} [{'|'.join(PERIODS)}]`")
+            return None
+
+        members = await _registered_members(ctx.guild, ctx.bot.intents.members)
+        if not members:
+            await ctx.send("❌ Nobody in this server has linked a Trakt account yet. Use `tset <username>`.")
+            return None
+
+        await refresh_histories(list(members))
+        return members
+
+    @commands.command(name="tgtop")
+    @commands.guild_only()
+    async def trakt_guild_top(self, ctx, period=DEFAULT_PERIOD):
+        """Leaderboard of this server's members by watch time (default: last 7 days)"""
+        members = await self._prepare(ctx, period)
+        if members is None:
+            return
+
+        rows = get_guild_leaderboard(list(members), period_since(period.lower()), limit=LEADERBOARD_SIZE)
+        if not rows:
+            await ctx.send("❌ Nothing watched in this server in that period.")
+            return
+
+        medals = ["🥇", "🥈", "🥉"]
+        lines = []
+        for rank, (username, episodes, movies, minutes) in enumerate(rows):
+            place = medals[rank] if rank < len(medals) else f"**{rank + 1}.**"
+            lines.append(
+                f"{place} {members[username].display_name} — **{format_hours(minutes)}** "
+                f"({episodes} episodes, {movies} movies)"
+            )
+
+        embed = discord.Embed(
+            title=f"🏆 {ctx.guild.name} leaderboard ({period.lower()})",
+            description="\n".join(lines),
+            color=0x1DB954
+        )
+        embed.set_footer(text=f"👥 {len(members)} linked members")
+        with metrics.phase("discord_send"):
+            await ctx.send(embed=embed)
+
+    @commands.command(name="tgtrend")
+    @commands.guild_only()
+    async def trakt_guild_trending(self, ctx, period=DEFAULT_PERIOD):
+        """What this server is watching: titles with the most watchers (default: last 7 days)"""
+        members = await self._prepare(ctx, period)
+        if members is None:
+            return
+
+        rows = get_guild_trending(list(members), period_since(period.lower()), limit=TRENDING_SIZE)
+        if not rows:
+            await ctx.send("❌ Nothing watched in this server in that period.")
+            return
+
+        lines = []
+        for rank, (media_type, title, year, watchers, plays, _) in enumerate(rows, start=1):
+            icon = "🎬" if media_type == "movie" else "📺"
+            name = f"{title} ({year})" if year else title
+            lines.append(f"**{rank}.** {icon} {name} — {watchers} watching, {plays} plays")
+
+        embed = discord.Embed(
+            title=f"🔥 Trending in {ctx.guild.name} ({period.lower()})",
+            description="\n".join(lines),
+            color=0x1DB954
+        )
+        with metrics.phase("discord_send"):
+            await ctx.send(embed=embed)
+
+    @commands.command(name="tg9")
+    @commands.guild_only()
+    async def trakt_guild_collage(self, ctx, period=DEFAULT_PERIOD):
+        """The nine titles this server watched most recently, as a 3x3 collage"""
+        members = await self._prepare(ctx, period)
+        if members is None:
+            return
+
+        rows = get_guild_recent_titles(list(members), period_since(period.lower()), limit=9)
+        if not rows:
+            await ctx.send("❌ Nothing watched in this server in that period.")
+            return
+
+        posters = await get_tmdb_posters([
+            ("movie" if media_type == "movie" else "tv", tmdb_id, title, year)
+            for media_type, title, year, tmdb_id, _ in rows
+        ])
+        image_data = [(poster or FALLBACK_POSTER, row[1]) for poster, row in zip(posters, rows)]
+        image_bytes, _ = await create_collage(image_data, 3, 3, COLLAGE_TILE_WIDTH, COLLAGE_TILE_HEIGHT)
+
+        embed = discord.Embed(
+            title=f"🗂️ {ctx.guild.name} is watching ({period.lower()})",
+            color=0x2F3136
+        )
+        embed.set_image(url="attachment://guild.webp")
+        embed.set_footer(text=f"👥 {len(members)} linked members")
+
+        file = discord.File(image_bytes, filename="guild.webp")
+        with metrics.phase("discord_send"):
+            await ctx.send(embed=embed, file=file)
+
+
+async def setup(bot):
+    await bot.add_cog(GuildCog(bot))
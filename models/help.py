@@ -18,6 +18,12 @@ class HelpCog(commands.Cog):  # Optional: rename class too
                 f"`{prefix}t6` — Show your six recently watched movies\n"
                 f"`{prefix}t6s` — Show your six recently watched shows\n"
                 f"`{prefix}tw` — Show your Trakt watchlist\n"
+                f"`{prefix}t9` / `{prefix}t16` / `{prefix}t25 [7d|1m|3m|6m|12m|all] [movies|shows|all]` — "
+                f"Your top titles as a 3x3 / 4x4 / 5x5 collage\n"
+                f"`{prefix}tstats-user [member]` — All-time stats: top titles, watch time, months, weekdays, streaks\n"
+                f"`{prefix}tyear [year]` — Your year in review as an image\n"
+                f"`{prefix}tgtop` / `{prefix}tgtrend` / `{prefix}tg9 [7d|1m|3m|6m|12m|all]` — "
+                f"Server leaderboard, what the server is watching, server collage\n"
             ),
             color=0x1DB954
         )
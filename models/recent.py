@@ -1,25 +1,24 @@
+import calendar
 import discord
-import json
 import os
 from discord.ext import commands
 from datetime import datetime
 
 today_str = datetime.now().date().isoformat()
 
-from tmbd_api import get_tmdb_movie_poster
-from trakt_api import get_recent_activity
+from database.database import get_latest_play, get_plays_per_day
+from tmbd_api import get_tmdb_movie_poster, get_tmdb_show_poster
+from utils.display import FALLBACK_POSTER
+from utils.image_grid import resolve_poster_url
+from utils.metrics import metrics
+from utils.trakt_utils import refresh_history
+from utils.user_registry import user_registry
 
-USER_DATA_FILE = "users.json"
 TRAKT_API_KEY = os.getenv("TRAKT_API_KEY")
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
-FALLBACK_POSTER = "https://i.imgur.com/Z2MYNbj.png"
 IMAGE_CACHE_DIR = "image_cache"
-
-def load_users():
-    if not os.path.exists(USER_DATA_FILE):
-        return {}
-    with open(USER_DATA_FILE, "r") as f:
-        return json.load(f)
+# Discord shows embed thumbnails small, so ask TMDB for a small size
+EMBED_POSTER_WIDTH = 154
 
 class RecentCog(commands.Cog):
     def __init__(self, bot):
@@ -27,10 +26,9 @@ class RecentCog(commands.Cog):
 
     @commands.hybrid_command(name="tr")
     async def trakt_recent(self, ctx):
-        users = load_users()
-        user_id = str(ctx.author.id)
+        username = user_registry.get(ctx.author.id)
 
-        if user_id not in users:
+        if username is None:
             embed = discord.Embed(
                 title="📌 Trakt Account Not Registered",
                 description=(
@@ -43,35 +41,27 @@ class RecentCog(commands.Cog):
             await ctx.send(embed=embed)
             return
 
-        username = users[user_id]
-        history = get_recent_activity(username)
-        if not history:
+        # One small incremental sync, then everything comes from the local history
+        await refresh_history(username)
+        play = get_latest_play(username)
+        if not play:
             await ctx.send("❌ No recent activity found.")
             return
 
-        first_entry = history[0]
-        item = first_entry.get('movie') or first_entry.get('show')
-        is_movie = 'movie' in first_entry
-        images = item.get('images', {})
-        poster_url = images.get("poster", [None])[0]
+        is_movie = play["media_type"] == "movie"
+        title = play["title"] or 'Unknown'
+        year = play["year"] or 'Unknown'
+        date = (play["watched_at"] or '').split('T')[0]
 
-        # fallback to TMDb if Trakt doesn't return one
-        if not poster_url:
-            title = item.get('title', 'Unknown')
-            year = item.get('year', 'Unknown')
-            poster_url = get_tmdb_movie_poster(title, year)
+        if is_movie:
+            poster_url = await get_tmdb_movie_poster(title, year, play["tmdb_id"])
+        else:
+            poster_url = await get_tmdb_show_poster(title, year, play["tmdb_id"])
 
         # fallback to static image if all else fails
         if not poster_url:
             poster_url = FALLBACK_POSTER
-        else:
-            # Ensure full URL format
-            if not poster_url.startswith("http"):
-                poster_url = "https://" + poster_url
-
-        title = item.get('title', 'Unknown')
-        year = item.get('year', 'Unknown')
-        date = first_entry.get('watched_at', '').split('T')[0]
+        poster_url = resolve_poster_url(poster_url, EMBED_POSTER_WIDTH)
 
         embed = discord.Embed(
             title=f"📽️ Recent activity by {ctx.author.display_name}",
@@ -85,10 +75,9 @@ class RecentCog(commands.Cog):
                 inline=False
             )
         else:
-            episode = first_entry.get('episode', {})
-            season = episode.get('season', 0)
-            number = episode.get('number', 0)
-            ep_title = episode.get('title', 'Unknown Episode')
+            season = play["season"] or 0
+            number = play["episode"] or 0
+            ep_title = play["episode_title"] or 'Unknown Episode'
 
             embed.add_field(
                 name=f"{title} ({year})",
@@ -97,16 +86,15 @@ class RecentCog(commands.Cog):
             )
 
             today = datetime.utcnow().date()
-            binge_count = sum(
-                1 for e in history
-                if 'show' in e and
-                datetime.fromisoformat(e.get('watched_at', '').replace('Z', '+00:00')).date() == today
-            )
+            today_start = calendar.timegm(today.timetuple())
+            plays_per_day = dict(get_plays_per_day(username, today_start, media_type="shows"))
+            binge_count = plays_per_day.get(today.isoformat(), 0)
             if binge_count > 1:
                 embed.set_footer(text=f"🔥 {binge_count} episodes watched today — binge mode!")
 
         embed.set_thumbnail(url=poster_url)
-        await ctx.send(embed=embed)
+        with metrics.phase("discord_send"):
+            await ctx.send(embed=embed)
 
 
 async def setup(bot):
@@ -1,27 +1,20 @@
 import discord
 from discord.ext import commands
 import os
-import json
 
-from tmbd_api import get_tmdb_movie_poster, get_tmdb_show_poster
+from tmbd_api import get_tmdb_posters
 from trakt_api import get_recent_history
+from utils.display import FALLBACK_POSTER
 from utils.image_grid import create_titled_image_grid
-from utils.trakt_utils import save_recent_trakt_data
-from database.database import count_total_scrobbles
+from utils.metrics import metrics
+from utils.trakt_utils import refresh_history
+from utils.user_registry import user_registry
+from database.database import count_total_scrobbles, get_latest_movies, get_latest_shows
 
-USER_DATA_FILE = "users.json"
 TRAKT_API_KEY = os.getenv("TRAKT_API_KEY")
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
-FALLBACK_POSTER = "https://i.imgur.com/Z2MYNbj.png"
 IMAGE_CACHE_DIR = "image_cache"
 
-def load_users():
-    if not os.path.exists(USER_DATA_FILE):
-        return {}
-    with open(USER_DATA_FILE, "r") as f:
-        return json.load(f)
-
-
 class Recent6Cog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -29,10 +22,9 @@ class Recent6Cog(commands.Cog):
     @commands.command(name="t6")
     async def trakt_six_recent(self, ctx):
         """Show 6 recent movies in a grid image with overlaid titles"""
-        users = load_users()
-        user_id = str(ctx.author.id)
+        username = user_registry.get(ctx.author.id)
 
-        if user_id not in users:
+        if username is None:
             embed = discord.Embed(
                 title="📌 Trakt Account Not Registered",
                 description=(
@@ -45,40 +37,29 @@ class Recent6Cog(commands.Cog):
             await ctx.send(embed=embed)
             return
 
-        username = users[user_id]
-        history = get_recent_history(username, media_type="movies", per_page=100)
-
-        if not history:
-            await ctx.send("❌ No recent activity found.")
-            return
-
-        save_recent_trakt_data(username, history)
-
-        # Gather up to 6 recent movies
-        movies = [entry for entry in history if 'movie' in entry][:6]
+        # One small incremental sync, then the movies come from the local history
+        await refresh_history(username)
+        movie_scrobbles, show_scrobbles = count_total_scrobbles(username)
+        if movie_scrobbles or show_scrobbles:
+            movies = get_latest_movies(username, limit=6)
+        else:
+            # Nothing stored yet (the tset import hasn't run): ask Trakt directly
+            history = await get_recent_history(username, media_type="movies", per_page=6)
+            movies = [
+                (movie.get("title"), movie.get("year"), (movie.get("ids") or {}).get("tmdb"), None)
+                for movie in (entry.get("movie") for entry in history) if movie
+            ]
 
         if not movies:
             await ctx.send("❌ No recent movies found.")
             return
 
-        # Prepare poster URLs and titles
-        grid_data = []
-        for entry in movies:
-            item = entry["movie"]
-            title = item.get("title", "Unknown")
-            year = item.get("year", "Unknown")
-            full_title = f"{title} ({year})"
-            poster_url = item.get("images", {}).get("poster", [None])[0]
-
-            if not poster_url:
-                poster_url = get_tmdb_movie_poster(title, year)
-
-            if not poster_url:
-                poster_url = FALLBACK_POSTER
-            elif not poster_url.startswith("http"):
-                poster_url = "https://" + poster_url
-
-            grid_data.append((poster_url, full_title))
+        # Prepare posters (TMDB paths, sized at render time) and titles
+        posters = await get_tmdb_posters([("movie", tmdb_id, title, year) for title, year, tmdb_id, _ in movies])
+        grid_data = [
+            (poster or FALLBACK_POSTER, f"{title or 'Unknown'} ({year or 'Unknown'})")
+            for (title, year, _, _), poster in zip(movies, posters)
+        ]
 
         # Create grid image
         image_bytes = await create_titled_image_grid(grid_data)
@@ -87,8 +68,6 @@ class Recent6Cog(commands.Cog):
             await ctx.send("❌ Failed to generate grid image.")
             return
 
-        # Count total scrobbles
-        movie_scrobbles, show_scrobbles = count_total_scrobbles(username)
         total_scrobbles = movie_scrobbles + show_scrobbles
 
         embed = discord.Embed(
@@ -100,7 +79,8 @@ class Recent6Cog(commands.Cog):
         embed.set_footer(text=f"🎬 Movies: {movie_scrobbles} | 📺 Shows: {show_scrobbles} | 📊 Total: {total_scrobbles}")
 
         file = discord.File(image_bytes, filename="grid.webp")
-        await ctx.send(embed=embed, file=file)
+        with metrics.phase("discord_send"):
+            await ctx.send(embed=embed, file=file)
 
 
 class Recent6CogShow(commands.Cog):
@@ -110,10 +90,9 @@ class Recent6CogShow(commands.Cog):
     @commands.command(name="t6s")
     async def trakt_six_recent(self, ctx):
         """Show 6 recent shows in a grid image with overlaid titles"""
-        users = load_users()
-        user_id = str(ctx.author.id)
+        username = user_registry.get(ctx.author.id)
 
-        if user_id not in users:
+        if username is None:
             embed = discord.Embed(
                 title="📌 Trakt Account Not Registered",
                 description=(
@@ -126,53 +105,21 @@ class Recent6CogShow(commands.Cog):
             await ctx.send(embed=embed)
             return
 
-        username = users[user_id]
-        history = get_recent_history(username, media_type="shows", per_page=100)
-
-        if not history:
-            await ctx.send("❌ No recent activity found.")
-            return
-
-        save_recent_trakt_data(username, history)
-
-        # Gather up to 6 recent shows
-        seen_titles = set()
-        shows = []
-
-        for entry in history:
-            if 'show' in entry:
-                show = entry['show']
-                title = show.get('title')
-                year = show.get('year')
-                key = f"{title}_{year}"
-
-                if key not in seen_titles:
-                    seen_titles.add(key)
-                    shows.append(show)
-
-                if len(shows) == 6:
-                    break
+        # One small incremental sync, then the distinct shows come from the local history,
+        # however many episodes were binged in between
+        await refresh_history(username)
+        shows = get_latest_shows(username, limit=6)
 
         if not shows:
             await ctx.send("❌ No recent shows found.")
             return
 
-        # Prepare poster URLs and titles
-        grid_data = []
-        for show in shows:
-            title = show.get("title", "Unknown")
-            year = show.get("year", "Unknown")
-            full_title = f"{title} ({year})"
-            poster_url = show.get("images", {}).get("poster", [None])[0]
-
-            if not poster_url:
-                poster_url = get_tmdb_show_poster(title, year)
-            if not poster_url:
-                poster_url = FALLBACK_POSTER
-            elif not poster_url.startswith("http"):
-                poster_url = "https://" + poster_url
-
-            grid_data.append((poster_url, full_title))
+        # Prepare posters (TMDB paths, sized at render time) and titles
+        posters = await get_tmdb_posters([("tv", tmdb_id, title, year) for title, year, tmdb_id, _ in shows])
+        grid_data = [
+            (poster or FALLBACK_POSTER, f"{title} ({year or 'Unknown'})")
+            for (title, year, _, _), poster in zip(shows, posters)
+        ]
 
         # Create grid image
         image_bytes = await create_titled_image_grid(grid_data)
@@ -195,7 +142,8 @@ class Recent6CogShow(commands.Cog):
 
 
         file = discord.File(image_bytes, filename="grid.webp")
-        await ctx.send(embed=embed, file=file)
+        with metrics.phase("discord_send"):
+            await ctx.send(embed=embed, file=file)
 
 async def setup(bot):
     await bot.add_cog(Recent6Cog(bot))
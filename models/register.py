@@ -1,43 +1,41 @@
+import asyncio
 import discord
 from discord.ext import commands
-import json
 import os
-import requests
 
-from database.database import save_history_to_db
-from trakt_api import get_full_history
+from trakt_api import TraktAPIError, trakt_user_exists
+from utils.import_jobs import import_queue
+from utils.metrics import metrics
+from utils.user_registry import user_registry
 
-USER_DATA_FILE = "users.json"
 TRAKT_API_KEY = os.getenv("TRAKT_API_KEY")
 
-def load_users():
-    if not os.path.exists(USER_DATA_FILE):
-        return {}
-    with open(USER_DATA_FILE, "r") as f:
-        return json.load(f)
-
-def save_users(users):
-    with open(USER_DATA_FILE, "w") as f:
-        json.dump(users, f, indent=2)
-
-def trakt_user_exists(username):
-    url = f"https://api.trakt.tv/users/{username}"
-    headers = {
-        "Content-Type": "application/json",
-        "trakt-api-version": "2",
-        "trakt-api-key": TRAKT_API_KEY
-    }
-    response = requests.get(url, headers=headers)
-    return response.status_code == 200
-
 class RegisterCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self._start_task = None
+
+    async def cog_load(self):
+        # Resumed jobs edit their progress messages, so wait until we're connected
+        async def start_when_ready():
+            await self.bot.wait_until_ready()
+            await import_queue.start(self.bot)
+        self._start_task = asyncio.create_task(start_when_ready())
+
+    async def cog_unload(self):
+        self._start_task.cancel()
+        await import_queue.stop()
 
     @commands.command(name="tset")
     async def trakt_register(self, ctx, username):
         # Validate the Trakt username first
-        if not trakt_user_exists(username):
+        try:
+            exists = await trakt_user_exists(username)
+        except TraktAPIError as e:
+            print(f"Couldn't check Trakt user {username}: {e}")
+            await ctx.send("❌ Couldn't reach Trakt right now, please try `tset` again later.")
+            return
+        if not exists:
             embed = discord.Embed(
                 title="❌ Invalid Trakt Username",
                 description=f"The username `{username}` does not exist on [Trakt](https://trakt.tv). Please double-check and try again.",
@@ -47,24 +45,22 @@ class RegisterCog(commands.Cog):
             return
 
         # Save user if valid
-        users = load_users()
-        users[str(ctx.author.id)] = username
-        save_users(users)
-
-        await ctx.send(f"🔄 Fetching full history for `{username}`...")
+        user_registry.set(ctx.author.id, username)
 
-        shows = get_full_history(username, "shows")
-        movies = get_full_history(username, "movies")
-        save_history_to_db(username, shows, movies)
-
-        await ctx.send(f"✅ History saved for `{username}`!")
+        progress = await ctx.send(f"⏳ Import for `{username}` is queued...")
+        job, created = await import_queue.submit(username, ctx.channel.id, progress.id)
+        if job is None:
+            await progress.edit(content="❌ Too many imports are running right now, please try `tset` again later.")
+        elif not created:
+            await progress.edit(content=f"🔄 `{username}` is already being imported, progress is shown in the earlier message.")
 
         embed = discord.Embed(
             title="✅ Trakt Account Linked",
             description=f"[**{username}**](https://trakt.tv/users/{username}) has been linked to {ctx.author.mention}",
             color=0x1DB954
         )
-        await ctx.send(embed=embed)
+        with metrics.phase("discord_send"):
+            await ctx.send(embed=embed)
 
 # IMPORTANT: async setup function with awaited add_cog
 async def setup(bot):
@@ -0,0 +1,146 @@
+import os
+import time
+import traceback
+
+import discord
+from aiohttp import web
+from discord.ext import commands
+
+from utils.image_grid import grid_cache, tile_cache
+from utils.metrics import current_command, metrics
+from utils.poster_cache import poster_cache
+
+# Prometheus endpoint; off unless METRICS_PORT is set
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+PHASES = ["registry_lookup", "trakt_fetch", "analytics", "poster_resolution", "download", "render", "encode",
+          "discord_send"]
+
+
+def _cache_lookups():
+    """(cache, result) -> count for every cache, read straight from the caches themselves."""
+    tmdb = metrics.counter_values("trakt_fm_tmdb_lookups_total")
+    counts = {
+        "grid": (grid_cache.hits, grid_cache.misses),
+        "tile": (tile_cache.hits, tile_cache.misses),
+        "poster_memory": (poster_cache.memory.hits, poster_cache.memory.misses),
+        "poster_disk": (poster_cache.disk_hits, poster_cache.network_fetches),
+        "tmdb_lookup": (tmdb.get((("result", "hit"),), 0), tmdb.get((("result", "miss"),), 0)),
+    }
+    values = {}
+    for cache, (hits, misses) in counts.items():
+        values[(("cache", cache), ("result", "hit"))] = hits
+        values[(("cache", cache), ("result", "miss"))] = misses
+    return values
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.0f}"
+
+
+def _label(labels, key):
+    return dict(labels).get(key, "-")
+
+
+class StatsCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self._runner = None
+
+    async def cog_load(self):
+        # Global hooks run inside the command's own task, so current_command is
+        # visible to every phase timer the command goes through
+        self.bot.before_invoke(self._before_invoke)
+        self.bot.after_invoke(self._after_invoke)
+        metrics.collect("trakt_fm_cache_lookups_total", _cache_lookups, kind="counter")
+
+        if METRICS_PORT:
+            app = web.Application()
+            app.router.add_get("/metrics", self._serve_metrics)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, METRICS_HOST, METRICS_PORT).start()
+            print(f"📈 Metrics at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    async def cog_unload(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _serve_metrics(self, request):
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def _before_invoke(self, ctx):
+        ctx.metrics_started_at = time.perf_counter()
+        current_command.set(ctx.command.qualified_name)
+
+    async def _after_invoke(self, ctx):
+        command = ctx.command.qualified_name
+        metrics.observe("trakt_fm_command_seconds", time.perf_counter() - ctx.metrics_started_at, command=command)
+        metrics.inc("trakt_fm_commands_total", command=command, outcome="error" if ctx.command_failed else "ok")
+
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx, error):
+        # Having any listener turns off discord.py's default logging, so keep printing tracebacks
+        if isinstance(error, commands.CommandNotFound):
+            return
+        if ctx.command is not None and ctx.command.has_error_handler():
+            return
+        print(f"Ignoring exception in command {ctx.command}:")
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+    @commands.command(name="tstats")
+    @commands.is_owner()
+    async def trakt_stats(self, ctx):
+        """Latency, upstream and cache statistics since startup (bot owner only)"""
+        outcomes = metrics.counter_values("trakt_fm_commands_total")
+        lines = [f"{'command':<10}{'calls':>7}{'err':>5}{'p50':>7}{'p95':>7}"]
+        for labels, h in sorted(metrics.histogram_values("trakt_fm_command_seconds").items()):
+            errors = outcomes.get(labels + (("outcome", "error"),), 0)
+            lines.append(f"{_label(labels, 'command'):<10}{h.count:>7}{errors:>5.0f}"
+                         f"{_ms(h.quantile(0.5)):>7}{_ms(h.quantile(0.95)):>7}")
+        commands_text = "\n".join(lines)
+
+        by_phase = {}
+        for labels, h in metrics.histogram_values("trakt_fm_phase_seconds").items():
+            by_phase.setdefault(_label(labels, "phase"), []).append(h)
+        lines = [f"{'phase':<18}{'calls':>7}{'avg':>7}"]
+        for phase in PHASES:
+            histograms = by_phase.get(phase, [])
+            count = sum(h.count for h in histograms)
+            total = sum(h.sum for h in histograms)
+            lines.append(f"{phase:<18}{count:>7}{_ms(total / count) if count else '-':>7}")
+        phases_text = "\n".join(lines)
+
+        requests = metrics.counter_values("trakt_fm_upstream_requests_total")
+        coalesced = metrics.counter_values("trakt_fm_upstream_coalesced_total")
+        errors = metrics.counter_values("trakt_fm_upstream_errors_total")
+        latency = metrics.histogram_values("trakt_fm_upstream_seconds")
+        lines = [f"{'upstream':<8}{'calls':>7}{'saved':>7}{'err%':>6}{'p50':>6}{'p95':>6}"]
+        for labels, count in sorted(requests.items()):
+            h = latency.get(labels)
+            lines.append(
+                f"{_label(labels, 'upstream'):<8}{count:>7.0f}{coalesced.get(labels, 0):>7.0f}"
+                f"{errors.get(labels, 0) / count * 100:>6.1f}"
+                f"{_ms(h.quantile(0.5)) if h else '-':>6}{_ms(h.quantile(0.95)) if h else '-':>6}"
+            )
+        upstream_text = "\n".join(lines)
+
+        lookups = _cache_lookups()
+        lines = [f"{'cache':<14}{'hits':>8}{'misses':>8}{'ratio':>7}"]
+        for cache in ["grid", "tile", "poster_memory", "poster_disk", "tmdb_lookup"]:
+            hits = lookups[(("cache", cache), ("result", "hit"))]
+            misses = lookups[(("cache", cache), ("result", "miss"))]
+            ratio = f"{hits / (hits + misses) * 100:.0f}%" if hits + misses else "-"
+            lines.append(f"{cache:<14}{hits:>8.0f}{misses:>8.0f}{ratio:>7}")
+        caches_text = "\n".join(lines)
+
+        embed = discord.Embed(title="📈 trakt.fm stats", color=0x2F3136)
+        embed.add_field(name="Commands (ms)", value=f"```{commands_text}```", inline=False)
+        embed.add_field(name="Phases (ms)", value=f"```{phases_text}```", inline=False)
+        embed.add_field(name="Upstreams (ms)", value=f"```{upstream_text}```", inline=False)
+        embed.add_field(name="Caches", value=f"```{caches_text}```", inline=False)
+        await ctx.send(embed=embed)
+
+
+async def setup(bot):
+    await bot.add_cog(StatsCog(bot))
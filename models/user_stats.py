@@ -0,0 +1,85 @@
+import discord
+from discord.ext import commands
+
+from database.database import get_user_stats
+from utils.display import format_hours
+from utils.metrics import metrics
+from utils.trakt_utils import refresh_history
+from utils.user_registry import user_registry
+
+WEEKDAYS = ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
+BAR_WIDTH = 12
+
+
+def _bars(rows):
+    """[(label, value)] as a text bar chart scaled to the biggest value."""
+    top = max((value for _, value in rows), default=0) or 1
+    return "\n".join(
+        f"{label:<7}{'█' * round(value / top * BAR_WIDTH):<{BAR_WIDTH}} {value}" for label, value in rows
+    )
+
+
+def _top_list(rows, with_year):
+    if not rows:
+        return "Nothing yet"
+    lines = []
+    for rank, (title, year, plays, minutes, _) in enumerate(rows, start=1):
+        name = f"{title} ({year})" if with_year and year else title
+        lines.append(f"**{rank}.** {name} — {plays} plays, {format_hours(minutes)}")
+    return "\n".join(lines)
+
+
+class UserStatsCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.hybrid_command(name="tstats-user")
+    async def trakt_user_stats(self, ctx, member: discord.Member = None):
+        """All-time stats for you or another member: top titles, watch time, months, weekdays and streaks"""
+        member = member or ctx.author
+        username = user_registry.get(member.id)
+        if username is None:
+            await ctx.send(f"❌ {member.display_name} hasn't linked a Trakt account yet. Use `tset <username>`.")
+            return
+
+        await refresh_history(username)
+        # A few lookups on the rollup tables, however long the history is
+        stats = get_user_stats(username)
+        show_plays, show_minutes = stats["shows"]
+        movie_plays, movie_minutes = stats["movies"]
+        if not show_plays and not movie_plays:
+            await ctx.send(f"❌ No history stored for {username} yet.")
+            return
+
+        embed = discord.Embed(
+            title=f"📊 Stats for {member.display_name}",
+            url=f"https://trakt.tv/users/{username}",
+            description=(
+                f"⏱️ **{format_hours(show_minutes + movie_minutes)}** watched — "
+                f"📺 {show_plays:,} episodes ({format_hours(show_minutes)}), "
+                f"🎬 {movie_plays:,} movies ({format_hours(movie_minutes)})"
+            ),
+            color=0x1DB954
+        )
+        embed.add_field(name="📺 Top shows", value=_top_list(stats["top_shows"], False), inline=False)
+        embed.add_field(name="🎬 Top movies", value=_top_list(stats["top_movies"], True), inline=False)
+
+        months = [(month, plays) for month, plays, _ in stats["per_month"]]
+        embed.add_field(name="📅 Plays per month", value=f"```{_bars(months)}```", inline=False)
+        weekdays = list(zip(WEEKDAYS, stats["per_weekday"]))
+        embed.add_field(name="🗓️ Plays per weekday", value=f"```{_bars(weekdays)}```", inline=False)
+
+        streak = stats["longest_streak"]
+        best_day = stats["best_day"]
+        if streak:
+            embed.add_field(name="🔥 Longest streak", value=f"{streak[0]} days in a row\n{streak[1]} → {streak[2]}")
+        if best_day:
+            embed.add_field(name="🍿 Biggest binge", value=f"{best_day[1]} plays on {best_day[0]}")
+        embed.set_footer(text="All times in UTC")
+
+        with metrics.phase("discord_send"):
+            await ctx.send(embed=embed)
+
+
+async def setup(bot):
+    await bot.add_cog(UserStatsCog(bot))
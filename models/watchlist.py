@@ -1,35 +1,44 @@
+import asyncio
 import discord
 from discord.ext import commands
 from discord.ui import Button, View
-import requests
 import os
-import json
+from io import BytesIO
 
 from trakt_api import get_trakt_watchlist
-from tmbd_api import get_tmdb_movie_poster
-from utils.image_grid import create_titled_image_grids
+from tmbd_api import get_trakt_item_posters
+from utils.display import FALLBACK_POSTER
+from utils.image_grid import create_titled_image_grids, resolve_poster_url
+from utils.metrics import metrics
+from utils.user_registry import user_registry
 
-USER_DATA_FILE = "users.json"
 TRAKT_API_KEY = os.getenv("TRAKT_API_KEY")
-FALLBACK_POSTER = "https://i.imgur.com/Z2MYNbj.png"
 IMAGE_CACHE_DIR = "image_cache"
+# Embed images are shown at most ~400px wide
+EMBED_POSTER_WIDTH = 342
 
 
-def load_users():
-    if not os.path.exists(USER_DATA_FILE):
-        return {}
-    with open(USER_DATA_FILE, "r") as f:
-        return json.load(f)
+class WatchlistView(View):
+    """
+    Pages through a watchlist one item at a time.
 
+    Work is done ahead of the buttons: posters are resolved and embeds built for
+    the items next to the current one, and the "Show All" grid starts rendering as
+    soon as the view exists. Presses are answered from those memoized results; the
+    interaction is deferred first so a slow one still can't miss Discord's 3-second deadline.
+    """
 
-class WatchlistView(View):
     def __init__(self, watchlist, username, author_name):
         super().__init__(timeout=60)
         self.watchlist = watchlist
         self.username = username
         self.author_name = author_name
         self.current_index = 0
+        self._posters = {}
+        self._embeds = {}
         self.update_buttons()
+        self._prefetch(self.current_index)
+        self._grid_task = asyncio.create_task(self._render_grid())
 
     def update_buttons(self):
         self.clear_items()
@@ -47,28 +56,56 @@ class WatchlistView(View):
         show_all_button.callback = self.show_all
         self.add_item(show_all_button)
 
-    async def get_current_embed(self):
-        entry = self.watchlist[self.current_index]
+    def _item(self, index):
+        entry = self.watchlist[index]
         media_type = entry.get("type")
         item = entry.get(media_type, {})
-        title = item.get("title", "Unknown")
-        year = item.get("year", "Unknown")
+        return media_type, item, item.get("title", "Unknown"), item.get("year", "Unknown")
+
+    async def _resolve_poster(self, index):
+        media_type, item, _, _ = self._item(index)
+        poster_url = (await get_trakt_item_posters([(media_type, item)]))[0]
+        return poster_url or FALLBACK_POSTER
+
+    @staticmethod
+    def _memoized(memo, index, coro_fn):
+        """
+        The task for `index` in `memo`, started on first use. Failed or cancelled tasks are
+        dropped from the memo when they finish, so the next press retries instead of failing forever.
+        """
+        task = memo.get(index)
+        if task is None:
+            task = memo[index] = asyncio.create_task(coro_fn(index))
+
+            def evict_failed(done):
+                if (done.cancelled() or done.exception() is not None) and memo.get(index) is done:
+                    del memo[index]
+
+            task.add_done_callback(evict_failed)
+        return task
+
+    def _poster(self, index):
+        """Task resolving the poster of `index`, started once and shared by the embed and the grid."""
+        return self._memoized(self._posters, index, self._resolve_poster)
+
+    def _embed(self, index):
+        return self._memoized(self._embeds, index, self._build_embed)
+
+    def _prefetch(self, index):
+        """Starts building the embeds on either side of `index` (and `index` itself)."""
+        for neighbour in (index, index + 1, index - 1):
+            self._embed(neighbour % len(self.watchlist))
+
+    async def _build_embed(self, index):
+        media_type, item, title, year = self._item(index)
         slug = item.get("ids", {}).get("slug", "")
         trakt_url = f"https://trakt.tv/{media_type}s/{slug}"
-
-        # Resolve poster
-        poster_url = item.get('images', {}).get('poster', [None])[0]
-        if not poster_url:
-            poster_url = get_tmdb_movie_poster(title, year)
-        if not poster_url:
-            poster_url = FALLBACK_POSTER
-        elif not poster_url.startswith("http"):
-            poster_url = "https://" + poster_url
+        poster_url = resolve_poster_url(await self._poster(index), EMBED_POSTER_WIDTH)
 
         embed = discord.Embed(
             title=f"🎬 {title} ({year})",
             url=trakt_url,
-            description=f"**{self.author_name}'s Watchlist**\nItem {self.current_index + 1} of {len(self.watchlist)}",
+            description=f"**{self.author_name}'s Watchlist**\nItem {index + 1} of {len(self.watchlist)}",
             color=0xe74c3c
         )
         embed.set_image(url=poster_url)
@@ -76,51 +113,63 @@ class WatchlistView(View):
 
         return embed
 
+    async def get_current_embed(self):
+        return await self._embed(self.current_index)
+
+    async def _render_grid(self):
+        try:
+            posters = await asyncio.gather(*(self._poster(index) for index in range(len(self.watchlist))))
+            grid_data = []
+            for index, poster_url in enumerate(posters):
+                _, _, title, year = self._item(index)
+                grid_data.append((poster_url, f"{title} ({year})"))
+            return (await create_titled_image_grids(grid_data)).getvalue()
+        except Exception as e:
+            print(f"Error rendering watchlist grid for {self.username}: {e!r}")
+            return None
+
+    async def _show_item(self, interaction, index):
+        # Acknowledge right away; the embed may still be waiting on a slow poster lookup
+        await interaction.response.defer()
+        self.current_index = index
+        self._prefetch(index)
+        try:
+            embed = await self.get_current_embed()
+        except Exception as e:
+            print(f"Error building watchlist embed for {self.username}: {e!r}")
+            await interaction.followup.send("❌ Couldn't load that item, try again.", ephemeral=True)
+            return
+        await interaction.edit_original_response(embed=embed, view=self)
+
     async def previous_item(self, interaction):
-        self.current_index = (self.current_index - 1) % len(self.watchlist)
-        embed = await self.get_current_embed()
-        await interaction.response.edit_message(embed=embed, view=self)
+        await self._show_item(interaction, (self.current_index - 1) % len(self.watchlist))
 
     async def next_item(self, interaction):
-        self.current_index = (self.current_index + 1) % len(self.watchlist)
-        embed = await self.get_current_embed()
-        await interaction.response.edit_message(embed=embed, view=self)
+        await self._show_item(interaction, (self.current_index + 1) % len(self.watchlist))
 
     async def show_all(self, interaction):
-        grid_data = []
-        titles = []
-
-        for entry in self.watchlist:
-            media_type = entry.get("type")
-            item = entry.get(media_type, {})
-            title = item.get("title", "Unknown")
-            year = item.get("year", "Unknown")
-            slug = item.get("ids", {}).get("slug", "")
-            trakt_url = f"https://trakt.tv/{media_type}s/{slug}"
-            titles.append(f"[{title} ({year})]({trakt_url})")
-
-            # Resolve poster
-            poster_url = item.get('images', {}).get('poster', [None])[0]
-            if not poster_url:
-                poster_url = get_tmdb_movie_poster(title, year)
-            if not poster_url:
-                poster_url = FALLBACK_POSTER
-            elif not poster_url.startswith("http"):
-                poster_url = "https://" + poster_url
-
-            grid_data.append((poster_url, f"{title} ({year})"))
-
-        image_bytes = await create_titled_image_grids(grid_data)
+        # The grid may still be resolving and compositing posters; acknowledge before waiting on it
+        await interaction.response.defer()
+        image_bytes = await self._grid_task
+        if image_bytes is None:
+            await interaction.followup.send("❌ Failed to generate grid image.", ephemeral=True)
+            return
 
         embed = discord.Embed(
             title=f"📺 {self.author_name}'s Trakt Watchlist",
             url=f"https://trakt.tv/users/{self.username}/watchlist",
             color=0xe74c3c
         )
-        file = discord.File(image_bytes, filename="watchlist.webp")
+        file = discord.File(BytesIO(image_bytes), filename="watchlist.webp")
         embed.set_image(url="attachment://watchlist.webp")
 
-        await interaction.response.edit_message(embed=embed, view=None, attachments=[file])
+        self.stop()
+        await interaction.edit_original_response(embed=embed, view=None, attachments=[file])
+
+    async def on_timeout(self):
+        # Nobody is going to press anything any more; drop work that hasn't finished
+        for task in [self._grid_task, *self._posters.values(), *self._embeds.values()]:
+            task.cancel()
 
 
 class WatchlistCog(commands.Cog):
@@ -129,10 +178,9 @@ class WatchlistCog(commands.Cog):
 
     @commands.command(name="tw")
     async def trakt_watchlist(self, ctx):
-        users = load_users()
-        user_id = str(ctx.author.id)
+        username = user_registry.get(ctx.author.id)
 
-        if user_id not in users:
+        if username is None:
             embed = discord.Embed(
                 title="📌 Trakt Account Not Registered",
                 description=(
@@ -145,8 +193,7 @@ class WatchlistCog(commands.Cog):
             await ctx.send(embed=embed)
             return
 
-        username = users[user_id]
-        watchlist = get_trakt_watchlist(username)
+        watchlist = await get_trakt_watchlist(username)
 
         if not watchlist:
             await ctx.send("❌ Failed to fetch or empty watchlist.")
@@ -158,7 +205,8 @@ class WatchlistCog(commands.Cog):
         view = WatchlistView(watchlist, username, ctx.author.display_name)
         initial_embed = await view.get_current_embed()
 
-        await ctx.send(embed=initial_embed, view=view)
+        with metrics.phase("discord_send"):
+            await ctx.send(embed=initial_embed, view=view)
 
 
 async def setup(bot):
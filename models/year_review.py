@@ -0,0 +1,67 @@
+import asyncio
+import discord
+from discord.ext import commands
+from datetime import datetime, timezone
+
+from utils.analytics import build_year_in_review
+from utils.image_grid import create_year_in_review
+from utils.metrics import metrics
+from utils.trakt_utils import refresh_history
+from utils.user_registry import user_registry
+
+# Trakt launched in 2010; nothing older can have been scrobbled
+FIRST_YEAR = 2010
+
+
+class YearReviewCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.hybrid_command(name="tyear")
+    async def trakt_year(self, ctx, year: int = None):
+        """Your year in review as one image: heatmap, when you watch, top titles and genres"""
+        username = user_registry.get(ctx.author.id)
+
+        if username is None:
+            embed = discord.Embed(
+                title="📌 Trakt Account Not Registered",
+                description=(
+                    "You haven't linked your Trakt account yet.\n\n"
+                    "**Register:** Use `tset <username>` to link your account.\n"
+                    "**Need an account?** [Sign up here](https://trakt.tv/signup)"
+                ),
+                color=discord.Color.red()
+            )
+            await ctx.send(embed=embed)
+            return
+
+        this_year = datetime.now(timezone.utc).year
+        year = year or this_year
+        if not FIRST_YEAR <= year <= this_year:
+            await ctx.send(f"❌ Pick a year between {FIRST_YEAR} and {this_year}.")
+            return
+
+        await refresh_history(username)
+        # Loading and aggregating a big history takes a few hundred ms; keep it off the event loop
+        with metrics.phase("analytics"):
+            report = await asyncio.to_thread(build_year_in_review, username, year)
+        if not report["plays"]:
+            await ctx.send(f"❌ Nothing watched in {year}.")
+            return
+
+        image = await create_year_in_review(report, f"{ctx.author.display_name}'s {year} in review")
+        embed = discord.Embed(
+            title=f"🗓️ {ctx.author.display_name}'s {year} in review",
+            url=f"https://trakt.tv/users/{username}",
+            color=0x1DB954
+        )
+        embed.set_image(url="attachment://year.webp")
+        embed.set_footer(text=f"📊 {report['plays']:,} plays | days and hours in UTC")
+
+        file = discord.File(image, filename="year.webp")
+        with metrics.phase("discord_send"):
+            await ctx.send(embed=embed, file=file)
+
+
+async def setup(bot):
+    await bot.add_cog(YearReviewCog(bot))
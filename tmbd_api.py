@@ -1,63 +1,152 @@
+import asyncio
 import os
-import requests
 from dotenv import load_dotenv
 
+from database.database import (
+    get_cached_tmdb_lookup, save_tmdb_lookup, get_cached_tmdb_posters, save_tmdb_posters
+)
+from utils.http import fetch
+from utils.metrics import metrics
+from utils.rate_limit import tmdb_limiter
+
 load_dotenv()
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
 TMDB_BASE_URL = "https://api.themoviedb.org/3"
-TMDB_IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500"
+TMDB_IMAGE_ROOT = "https://image.tmdb.org/t/p/"
+# Poster widths TMDB serves, smallest first ("original" is used past the largest)
+TMDB_POSTER_WIDTHS = [92, 154, 185, 342, 500, 780]
 
 
-def get_tmdb_movie_poster(title, year):
-    """Search TMDB for a movie poster"""
-    try:
-        url = "https://api.themoviedb.org/3/search/movie"
-        params = {
-            "api_key": TMDB_API_KEY,
-            "query": title,
-            "year": year,
-            "include_adult": False
-        }
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            results = response.json().get("results", [])
-            if results:
-                poster_path = results[0].get("poster_path")
-                if poster_path:
-                    return f"https://image.tmdb.org/t/p/w500{poster_path}"
-    except Exception as e:
-        print(f"TMDB Search Error: {e}")
-    return None
+def tmdb_image_url(poster_path, width=500):
+    """Returns the URL of the smallest TMDB poster size that is at least `width` pixels wide."""
+    for size in TMDB_POSTER_WIDTHS:
+        if size >= width:
+            return f"{TMDB_IMAGE_ROOT}w{size}{poster_path}"
+    return f"{TMDB_IMAGE_ROOT}original{poster_path}"
+
+
+async def _get(path, params=None, headers=None, timeout=None):
+    """
+    GET a TMDB endpoint through the shared rate limiter, retrying 429s and 5xx.
+    Returns (status, json_or_None). Network errors and timeouts come back as status 0.
+    """
+    status, data, _ = await fetch(f"{TMDB_BASE_URL}{path}", tmdb_limiter, params=params, headers=headers,
+                                  timeout=timeout)
+    return status, data
+
+
+async def _search_poster(media_type, title, year):
+    """
+    Search TMDB for a poster_path (e.g. "/abc.jpg"), going through the SQLite lookup cache.
+    Pass the path to tmdb_image_url() once the display size is known.
+    Misses are cached too (with a shorter TTL) so unknown titles aren't searched every time.
+    """
+    with metrics.phase("poster_resolution"):
+        # The cache lives in SQLite, which an import can hold for a while; never block the loop on it
+        hit, poster_path = await asyncio.to_thread(get_cached_tmdb_lookup, media_type, title, year)
+        metrics.inc("trakt_fm_tmdb_lookups_total", result="hit" if hit else "miss")
+        if hit:
+            return poster_path
 
-def get_tmdb_show_poster(title, year):
-    """Search TMDB for a movie poster"""
-    try:
-        url = "https://api.themoviedb.org/3/search/tv"
         params = {
-            "api_key": TMDB_API_KEY,
+            "api_key": TMDB_API_KEY or "",
             "query": title,
-            "year": year,
-            "include_adult": False
+            "include_adult": "false"
         }
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            results = response.json().get("results", [])
-            if results:
-                poster_path = results[0].get("poster_path")
-                if poster_path:
-                    return f"https://image.tmdb.org/t/p/w500{poster_path}"
-    except Exception as e:
-        print(f"TMDB Search Error: {e}")
-    return None
+        if isinstance(year, int) or str(year).isdigit():
+            params["year" if media_type == "movie" else "first_air_date_year"] = str(year)
+
+        status, data = await _get(f"/search/{media_type}", params)
+        if status != 200:
+            # Don't cache transient failures as "no poster"
+            return None
+
+        results = data.get("results", [])
+        tmdb_id = results[0].get("id") if results else None
+        poster_path = results[0].get("poster_path") if results else None
+        await asyncio.to_thread(save_tmdb_lookup, media_type, title, year, tmdb_id, poster_path)
+
+        return poster_path
+
+
+async def _fetch_poster_by_id(media_type, tmdb_id):
+    """Returns (ok, poster_path) from the title's details; a 404 is a valid "no poster" answer."""
+    status, data = await _get(f"/{media_type}/{tmdb_id}", {"api_key": TMDB_API_KEY or ""})
+    if status == 200:
+        return True, data.get("poster_path")
+    return status == 404, None
+
+
+async def get_tmdb_posters(items):
+    """
+    Resolves poster_paths for many titles at once.
+
+    `items` is a list of (media_type, tmdb_id, title, year) with media_type "movie" or "tv".
+    Titles with a TMDB id are looked up by id: cached ids come from one query per media
+    type and the rest are fetched concurrently from the details endpoint. Titles without
+    an id fall back to a title/year search. Returns poster_paths (or None) aligned with `items`.
+    """
+    with metrics.phase("poster_resolution"):
+        posters = {}
+        for media_type in {media_type for media_type, tmdb_id, _, _ in items if tmdb_id}:
+            ids = [tmdb_id for m, tmdb_id, _, _ in items if m == media_type and tmdb_id]
+            cached = await asyncio.to_thread(get_cached_tmdb_posters, media_type, ids)
+            metrics.inc("trakt_fm_tmdb_lookups_total", len(cached), result="hit")
+            posters.update({(media_type, tmdb_id): path for tmdb_id, path in cached.items()})
+
+        missing = list({(m, tmdb_id) for m, tmdb_id, _, _ in items if tmdb_id and (m, tmdb_id) not in posters})
+        metrics.inc("trakt_fm_tmdb_lookups_total", len(missing), result="miss")
+        fetched = await asyncio.gather(*(_fetch_poster_by_id(m, tmdb_id) for m, tmdb_id in missing))
+        found = {}
+        for (media_type, tmdb_id), (ok, poster_path) in zip(missing, fetched):
+            posters[(media_type, tmdb_id)] = poster_path
+            if ok:  # Don't cache transient failures as "no poster"
+                found.setdefault(media_type, {})[tmdb_id] = poster_path
+        for media_type, results in found.items():
+            await asyncio.to_thread(save_tmdb_posters, media_type, results)
+
+    async def resolve(media_type, tmdb_id, title, year):
+        if tmdb_id:
+            return posters.get((media_type, tmdb_id))
+        return await _search_poster(media_type, title, year)
+
+    return await asyncio.gather(*(resolve(*item) for item in items))
+
+
+async def get_tmdb_movie_poster(title, year, tmdb_id=None):
+    """TMDB poster_path for a movie, by id when known, otherwise by title search"""
+    return (await get_tmdb_posters([("movie", tmdb_id, title, year)]))[0]
+
+async def get_tmdb_show_poster(title, year, tmdb_id=None):
+    """TMDB poster_path for a show, by id when known, otherwise by title search"""
+    return (await get_tmdb_posters([("tv", tmdb_id, title, year)]))[0]
 
-def get_tmdb_person_poster(person_id):
-    url = f"{TMDB_BASE_URL}/person/{person_id}/images"
+async def get_tmdb_person_poster(person_id):
+    """Returns the URL of a person's first TMDB profile image (w500), or None."""
     headers = {"Authorization": f"Bearer {TMDB_API_KEY}"}
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        data = response.json()
+    status, data = await _get(f"/person/{person_id}/images", headers=headers)
+    if status == 200:
         profiles = data.get("profiles", [])
         if profiles:
-            return TMDB_IMAGE_BASE_URL + profiles[0]["file_path"]
+            return tmdb_image_url(profiles[0]["file_path"], 500)
     return None
 
+async def get_trakt_item_posters(items):
+    """
+    Poster references for Trakt movie/show objects, given as [(trakt_type, item)] with
+    trakt_type "movie" or "show". Uses the Trakt CDN image when the response carried one
+    (extended=images), otherwise the TMDB poster_path, by ids.tmdb when present.
+    Returns a list aligned with `items`; None where neither source has a poster.
+    """
+    posters = [(item.get("images") or {}).get("poster", [None])[0] for _, item in items]
+    missing = [index for index, poster in enumerate(posters) if not poster]
+    resolved = await get_tmdb_posters([
+        ("movie" if items[index][0] == "movie" else "tv",
+         (items[index][1].get("ids") or {}).get("tmdb"),
+         items[index][1].get("title", "Unknown"),
+         items[index][1].get("year", "Unknown"))
+        for index in missing
+    ])
+    for index, poster in zip(missing, resolved):
+        posters[index] = poster
+    return posters
@@ -1,70 +1,150 @@
-import requests
+import asyncio
 import os
 from dotenv import load_dotenv
 
+from utils.http import fetch
+from utils.metrics import metrics
+from utils.rate_limit import trakt_limiter
+
 load_dotenv()
 TRAKT_API_KEY = os.getenv("TRAKT_API_KEY")
+TRAKT_BASE_URL = "https://api.trakt.tv"
+HISTORY_PAGE_SIZE = 100
+# Max history pages requested at once per get_full_history call
+HISTORY_PAGE_CONCURRENCY = int(os.getenv("TRAKT_HISTORY_CONCURRENCY", "4"))
 
 HEADERS = {
     "Content-Type": "application/json",
-    "trakt-api-key": TRAKT_API_KEY,
+    "trakt-api-key": TRAKT_API_KEY or "",
     "trakt-api-version": "2"
 }
 
-def get_recent_activity(username):
-    url = f"https://api.trakt.tv/users/{username}/history?extended=images"
-    headers = {
-        "Content-Type": "application/json",
-        "trakt-api-key": TRAKT_API_KEY,
-        "trakt-api-version": "2"
-    }
-    response = requests.get(url, headers=headers)
-    return response.json() if response.status_code == 200 else None
-
-def get_full_history(username, media_type=None):
-    page = 1
-    per_page = 100
-    all_history = []
 
-    while True:
-        if media_type in ["movies", "shows", "episodes"]:
-            url = f"https://api.trakt.tv/users/{username}/history/{media_type}"
-        else:
-            url = f"https://api.trakt.tv/users/{username}/history"
+class TraktAPIError(Exception):
+    """A request Trakt kept failing after retries, where a partial result would be wrong."""
+
+    def __init__(self, status, path):
+        super().__init__(f"Trakt returned {status} for {path}")
+        self.status = status
+        self.path = path
+
+
+async def _request(path, params=None, timeout=None):
+    """
+    GET a Trakt endpoint through the shared rate limiter, retrying 429s and 5xx.
+    Returns (status, json_or_None, headers). Network errors and timeouts come back as status 0.
+    """
+    with metrics.phase("trakt_fetch"):
+        return await fetch(f"{TRAKT_BASE_URL}{path}", trakt_limiter, params=params, headers=HEADERS,
+                           timeout=timeout)
+
+
+async def _get(path, params=None, timeout=None):
+    status, data, _ = await _request(path, params, timeout)
+    return status, data
+
+
+def _history_path(username, media_type=None):
+    if media_type in ["movies", "shows", "episodes"]:
+        return f"/users/{username}/history/{media_type}"
+    return f"/users/{username}/history"
+
+
+async def trakt_user_exists(username, timeout=None):
+    """
+    True if the Trakt user exists, False if Trakt says it doesn't (404).
+    Raises TraktAPIError for anything else (rate limits, outages, network errors after retries).
+    """
+    path = f"/users/{username}"
+    status, _ = await _get(path, timeout=timeout)
+    if status == 200:
+        return True
+    if status == 404:
+        return False
+    raise TraktAPIError(status, path)
+
+
+async def get_full_history(username, media_type=None, timeout=None, max_in_flight=HISTORY_PAGE_CONCURRENCY,
+                           start_at=None, on_page=None):
+    """
+    Fetches every history page for a user, optionally only plays at or after `start_at`
+    (an ISO 8601 timestamp).
+    The first page tells us the page count (X-Pagination-Page-Count), the rest are
+    requested concurrently, at most `max_in_flight` at a time.
+    `on_page(page_count)` is called after each page arrives, with the total page count if known.
+    Raises TraktAPIError if a page still fails after retries, rather than returning a
+    truncated history that would look complete to the caller.
+    """
+    path = _history_path(username, media_type)
+
+    def page_params(page):
+        params = {"page": page, "limit": HISTORY_PAGE_SIZE, "extended": "full"}
+        if start_at:
+            params["start_at"] = start_at
+        return params
 
-        url += f"?page={page}&limit={per_page}&extended=full"
+    status, first_page, headers = await _request(path, page_params(1), timeout)
+    if status != 200:
+        raise TraktAPIError(status, path)
+    if not first_page:
+        return []
 
-        response = requests.get(url, headers=HEADERS)
-        if response.status_code != 200:
-            print(f"Error: {response.status_code} - {response.text}")
-            break
+    try:
+        page_count = int(headers.get("X-Pagination-Page-Count", ""))
+    except ValueError:
+        page_count = None
+
+    if on_page:
+        on_page(page_count)
+
+    if page_count is None:
+        # No pagination headers, fall back to walking pages until an empty one
+        return first_page + await _walk_history_pages(username, path, page_params, 2, timeout, on_page)
+
+    semaphore = asyncio.Semaphore(max(1, max_in_flight))
+
+    async def fetch_page(page):
+        async with semaphore:
+            result = await _get(path, page_params(page), timeout)
+        if on_page:
+            on_page(page_count)
+        return result
+
+    results = await asyncio.gather(*(fetch_page(page) for page in range(2, page_count + 1)))
+
+    all_history = list(first_page)
+    for page, (status, page_data) in enumerate(results, start=2):
+        if status != 200:
+            raise TraktAPIError(status, f"{path}?page={page}")
+        all_history.extend(page_data or [])
+
+    return all_history
+
+
+async def _walk_history_pages(username, path, page_params, page, timeout, on_page=None):
+    history = []
+    while True:
+        status, page_data = await _get(path, page_params(page), timeout)
+        if status != 200:
+            raise TraktAPIError(status, f"{path}?page={page}")
 
-        page_data = response.json()
         if not page_data:
             break  # No more pages
 
-        all_history.extend(page_data)
+        history.extend(page_data)
+        if on_page:
+            on_page(None)
         page += 1
 
-    return all_history
+    return history
 
-def get_trakt_watchlist(username):
-    url = f"https://api.trakt.tv/users/{username}/watchlist?extended=images"
-    headers = {
-        "Content-Type": "application/json",
-        "trakt-api-key": TRAKT_API_KEY,
-        "trakt-api-version": "2"
-    }
-    response = requests.get(url, headers=headers)
-    return response.json() if response.status_code == 200 else None
-
-def get_recent_history(username, media_type=None, page=1, per_page=100):
-    if media_type in ["movies", "shows", "episodes"]:
-        url = f"https://api.trakt.tv/users/{username}/history/{media_type}"
-    else:
-        url = f"https://api.trakt.tv/users/{username}/history"
 
-    url += f"?page={page}&limit={per_page}&extended=full"
+async def get_trakt_watchlist(username, timeout=None):
+    _, data = await _get(f"/users/{username}/watchlist", {"extended": "images"}, timeout=timeout)
+    return data
+
 
-    response = requests.get(url, headers=HEADERS)
-    return response.json() if response.status_code == 200 else []
\ No newline at end of file
+async def get_recent_history(username, media_type=None, page=1, per_page=100, timeout=None):
+    params = {"page": page, "limit": per_page, "extended": "full"}
+    _, data = await _get(_history_path(username, media_type), params, timeout=timeout)
+    return data or []
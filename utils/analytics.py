@@ -0,0 +1,157 @@
+import calendar
+from datetime import date, timedelta
+
+import numpy as np
+
+from database.database import get_play_columns
+
+DAY = 24 * 60 * 60
+TOP_TITLES = 5
+TOP_GENRES = 8
+
+
+class HistoryColumns:
+    """
+    A user's plays as parallel NumPy columns, one entry per play:
+    is_movie (bool), ts (epoch seconds), title_code and genre_code (indexes into
+    `titles` / `genre_lists`) and runtime (minutes, 0 when unknown).
+    """
+
+    def __init__(self, is_movie, ts, title_code, runtime, genre_code, titles, genre_lists):
+        self.is_movie = is_movie
+        self.ts = ts
+        self.title_code = title_code
+        self.runtime = runtime
+        self.genre_code = genre_code
+        # (is_movie, title) per title code, and the genres of each genre code
+        self.titles = titles
+        self.genre_lists = genre_lists
+
+    def __len__(self):
+        return len(self.ts)
+
+    @classmethod
+    def from_groups(cls, groups):
+        """Builds the columns from get_play_columns rows (one per title, plays packed as text)."""
+        if not groups:
+            empty = np.zeros(0, dtype=np.int32)
+            return cls(empty.astype(bool), empty.astype(np.int64), empty, empty, empty, [], [])
+
+        # Only the few hundred titles and genre strings are factorized in Python;
+        # the per-play (watched_ts, runtime) pairs are decoded in one split
+        title_codes = {}
+        genre_codes = {}
+        group_titles = [title_codes.setdefault((is_movie, title), len(title_codes))
+                        for is_movie, title, *_ in groups]
+        group_genres = [genre_codes.setdefault(genres, len(genre_codes)) for _, _, genres, *_ in groups]
+        counts = [plays for _, _, _, plays, _ in groups]
+        pairs = np.array(",".join(group[4] for group in groups).replace(":", ",").split(","),
+                         dtype=np.int64).reshape(-1, 2)
+        return cls(
+            np.repeat(np.array([is_movie for is_movie, *_ in groups], dtype=bool), counts),
+            pairs[:, 0],
+            np.repeat(np.array(group_titles, dtype=np.int32), counts),
+            pairs[:, 1].astype(np.int32),
+            np.repeat(np.array(group_genres, dtype=np.int32), counts),
+            [(bool(is_movie), title or "Unknown") for is_movie, title in title_codes],
+            [genres.split(",") if genres else [] for genres in genre_codes],
+        )
+
+
+def load_history(username, since, until):
+    return HistoryColumns.from_groups(get_play_columns(username, since, until))
+
+
+def _top_titles(columns, plays, minutes, movies):
+    is_movie = np.fromiter((movie for movie, _ in columns.titles), dtype=bool, count=len(columns.titles))
+    candidates = np.flatnonzero((is_movie == movies) & (plays > 0))
+    # Most plays first, ties broken by watch time
+    order = candidates[np.lexsort((-minutes[candidates], -plays[candidates]))][:TOP_TITLES]
+    return [(columns.titles[code][1], int(plays[code]), int(minutes[code])) for code in order]
+
+
+def _genre_shares(columns, minutes_by_code):
+    """[(genre, share of watch time)] for the top genres; a title's minutes are split across its genres."""
+    totals = {}
+    for code in np.flatnonzero(minutes_by_code):
+        genres = columns.genre_lists[code]
+        for genre in genres:
+            totals[genre] = totals.get(genre, 0.0) + minutes_by_code[code] / len(genres)
+    tagged = sum(totals.values())
+    if not tagged:
+        return []
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:TOP_GENRES]
+    return [(genre, float(minutes / tagged)) for genre, minutes in ranked]
+
+
+def _longest_run(active):
+    """(length, first index) of the longest run of True in `active`, or (0, None)."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0]))))
+    if not len(edges):
+        return 0, None
+    starts, lengths = edges[::2], edges[1::2] - edges[::2]
+    best = int(np.argmax(lengths))
+    return int(lengths[best]), int(starts[best])
+
+
+def year_in_review(columns, year):
+    """
+    Aggregates one calendar year (UTC) of `columns` for the recap image. Returns a dict with:
+    totals, per-day plays (the heatmap), a weekday x hour matrix (Monday first), minutes per
+    month, top shows and movies as [(title, plays, minutes)], genre shares and the longest
+    streak / busiest day as (days or plays, "YYYY-MM-DD").
+    """
+    start = calendar.timegm((year, 1, 1, 0, 0, 0))
+    end = calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+    days_in_year = (end - start) // DAY
+
+    in_year = (columns.ts >= start) & (columns.ts < end)
+    ts = columns.ts[in_year]
+    runtime = columns.runtime[in_year]
+    is_movie = columns.is_movie[in_year]
+    title_code = columns.title_code[in_year]
+    genre_code = columns.genre_code[in_year]
+
+    day = (ts - start) // DAY
+    plays_per_day = np.bincount(day, minlength=days_in_year)
+    # 1970-01-01 was a Thursday, so Monday is 0
+    weekday = (ts // DAY + 3) % 7
+    hour = ts % DAY // 3600
+    weekday_hour = np.bincount(weekday * 24 + hour, minlength=7 * 24).reshape(7, 24)
+    month = ts.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64) - (year - 1970) * 12
+    minutes_per_month = np.bincount(month, weights=runtime, minlength=12)
+
+    title_count = len(columns.titles)
+    title_plays = np.bincount(title_code, minlength=title_count)
+    title_minutes = np.bincount(title_code, weights=runtime, minlength=title_count)
+    genre_minutes = np.bincount(genre_code, weights=runtime, minlength=len(columns.genre_lists))
+
+    def day_str(index):
+        return (date(year, 1, 1) + timedelta(days=int(index))).isoformat()
+
+    streak, streak_start = _longest_run(plays_per_day > 0)
+    busiest = int(np.argmax(plays_per_day)) if len(ts) else None
+    return {
+        "year": year,
+        "plays": int(len(ts)),
+        "episodes": int(np.count_nonzero(~is_movie)),
+        "movies": int(np.count_nonzero(is_movie)),
+        "minutes": int(runtime.sum()),
+        "active_days": int(np.count_nonzero(plays_per_day)),
+        "plays_per_day": plays_per_day,
+        "first_weekday": calendar.weekday(year, 1, 1),
+        "weekday_hour": weekday_hour,
+        "minutes_per_month": minutes_per_month,
+        "top_shows": _top_titles(columns, title_plays, title_minutes, False),
+        "top_movies": _top_titles(columns, title_plays, title_minutes, True),
+        "genres": _genre_shares(columns, genre_minutes),
+        "longest_streak": (streak, day_str(streak_start)) if streak else None,
+        "busiest_day": (int(plays_per_day[busiest]), day_str(busiest)) if busiest is not None else None,
+    }
+
+
+def build_year_in_review(username, year):
+    """Loads just that year's plays and aggregates them. Blocking; run it in a thread."""
+    since = calendar.timegm((year, 1, 1, 0, 0, 0))
+    until = calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+    return year_in_review(load_history(username, since, until), year)
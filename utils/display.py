@@ -0,0 +1,21 @@
+import time
+
+# Shown wherever TMDB has no poster for a title
+FALLBACK_POSTER = "https://i.imgur.com/Z2MYNbj.png"
+
+# Period argument of the collage and guild commands -> days covered (None = all time)
+PERIODS = {"7d": 7, "1m": 30, "3m": 90, "6m": 180, "12m": 365, "all": None}
+
+
+def period_since(period):
+    """Lower bound in epoch seconds for a PERIODS key; 0 for all time."""
+    days = PERIODS[period]
+    if days is None:
+        return 0
+    return int(time.time()) - days * 24 * 60 * 60
+
+
+def format_hours(minutes):
+    """Watch time as hours, with a decimal only while it's under 10h."""
+    hours = minutes / 60
+    return f"{hours:.1f}h" if round(hours, 1) < 10 else f"{hours:,.0f}h"
@@ -0,0 +1,158 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+from utils.metrics import metrics
+
+# Seconds allowed for a single upstream call unless the caller asks otherwise
+DEFAULT_TIMEOUT = 10
+MAX_CONNECTIONS = 50
+MAX_CONNECTIONS_PER_HOST = 10
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 60
+
+_session = None
+_session_lock = asyncio.Lock()
+
+
+async def get_session():
+    """
+    Returns the process-wide aiohttp session, creating it on first use.
+    Every upstream call shares its keep-alive connection pool and DNS cache.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+
+    async with _session_lock:
+        if _session is None or _session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=MAX_CONNECTIONS,
+                limit_per_host=MAX_CONNECTIONS_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT
+            )
+            _session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT)
+            )
+    return _session
+
+
+async def close_session():
+    """Closes the shared session. Called once when the bot shuts down."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def make_timeout(seconds=None):
+    return aiohttp.ClientTimeout(total=seconds if seconds is not None else DEFAULT_TIMEOUT)
+
+
+# Statuses worth retrying; anything else is returned to the caller as-is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+
+def _retry_after(headers):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt):
+    # Full jitter: spreads retries from many callers instead of having them collide again
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+# In-flight requests by coalescing key
+_in_flight = {}
+
+
+def _coalesce_key(url, params, headers, read):
+    # Params and headers are order-insensitive; values are compared as strings, as sent
+    def normalize(mapping):
+        return tuple(sorted((str(k), str(v)) for k, v in (mapping or {}).items()))
+    return read, url.rstrip("?"), normalize(params), normalize(headers)
+
+
+async def fetch(url, limiter, params=None, headers=None, timeout=None, read="json", retries=MAX_RETRIES):
+    """
+    GET `url` through `limiter`, retrying 429/5xx responses and network errors with
+    jittered exponential backoff. A 429's Retry-After pauses the limiter for every caller.
+
+    Identical requests already in flight are coalesced: later callers await the first
+    one's result instead of hitting the network again, so callers must treat the
+    returned body as read-only.
+
+    Returns (status, body, headers) where body is parsed JSON (read="json") or bytes
+    (read="bytes") for 200 responses and None otherwise. Status 0 means the request
+    never got a response.
+    """
+    key = _coalesce_key(url, params, headers, read)
+    metrics.inc("trakt_fm_upstream_requests_total", upstream=limiter.name)
+    task = _in_flight.get(key)
+    if task is not None:
+        # Piggybacked on an identical request: one network call saved
+        metrics.inc("trakt_fm_upstream_coalesced_total", upstream=limiter.name)
+    else:
+        task = asyncio.create_task(_fetch_with_retries(url, limiter, params, headers, timeout, read, retries))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    # Shielded so one caller giving up doesn't cancel the request for everyone else
+    return await asyncio.shield(task)
+
+
+async def _fetch_with_retries(url, limiter, params, headers, timeout, read, retries):
+    session = await get_session()
+    attempt = 0
+    while True:
+        await limiter.acquire()
+        start = time.perf_counter()
+        try:
+            async with session.get(url, params=params, headers=headers, timeout=make_timeout(timeout)) as resp:
+                status, resp_headers = resp.status, resp.headers
+                body = None
+                if status == 200:
+                    body = await resp.json() if read == "json" else await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status, resp_headers, body = 0, {}, None
+            error = e
+        else:
+            error = None
+        metrics.observe("trakt_fm_upstream_seconds", time.perf_counter() - start, upstream=limiter.name)
+        metrics.inc("trakt_fm_upstream_responses_total", upstream=limiter.name, status=status)
+
+        if status == 200:
+            return status, body, resp_headers
+        if status not in RETRY_STATUSES and status != 0:
+            return status, None, resp_headers
+        if attempt >= retries:
+            metrics.inc("trakt_fm_upstream_errors_total", upstream=limiter.name)
+            if error is not None:
+                print(f"Giving up on {url}: {error!r}")
+            return status, None, resp_headers
+
+        delay = _retry_after(resp_headers) if status == 429 else None
+        if delay is not None:
+            limiter.pause(delay)
+        else:
+            await asyncio.sleep(_backoff(attempt))
+        attempt += 1
@@ -1,61 +1,220 @@
 from PIL import Image, ImageDraw, ImageFont
+import numpy as np
 from io import BytesIO
-import aiohttp
+import asyncio
+import hashlib
+from collections import deque
+import json
+import time
+
+from tmbd_api import tmdb_image_url
+from utils.display import format_hours
+from utils.lru import LRUCache
+from utils.metrics import metrics
+from utils.poster_cache import poster_cache
+from utils.render_pool import run_render
 
 POSTER_WIDTH = 200
 POSTER_HEIGHT = 300
 GRID_COLS = 3
 GRID_ROWS = 2
+MAX_CONCURRENT_DOWNLOADS = 6
+# Decoded posters/tiles alive at once while streaming a collage, independent of its size
+COLLAGE_WINDOW = 4
+GRID_CACHE_MAX_ITEMS = 256
+GRID_CACHE_MAX_BYTES = 32 * 1024 * 1024
+TILE_CACHE_MAX_BYTES = 64 * 1024 * 1024
 
-async def create_titled_image_grid(image_data):
+# Title bar layouts: the fixed 3x2 grid and the flexible watchlist grid
+TILE_STYLE_FIXED = "fixed"
+TILE_STYLE_FLEX = "flex"
+
+# Finished WEBP bytes keyed by the ordered (poster, title) list + layout
+grid_cache = LRUCache(max_items=GRID_CACHE_MAX_ITEMS, max_bytes=GRID_CACHE_MAX_BYTES)
+# Recent collage render durations in seconds, by "COLSxROWS", for sizing limits
+COLLAGE_TIMING_SAMPLES = 100
+collage_render_times = {}
+# Resized + captioned tiles as raw RGB, keyed by (source digest, title, width, height, style)
+tile_cache = LRUCache(max_bytes=TILE_CACHE_MAX_BYTES)
+
+
+def _grid_cache_key(kind, image_data, **layout):
+    payload = json.dumps([kind, [list(item) for item in image_data], layout], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def resolve_poster_url(poster, width):
     """
-    image_data: List of (poster_url, title) tuples
-    Returns: BytesIO object with the WEBP image grid
+    Turns a poster reference into a URL sized for a `width`-pixel tile.
+    `poster` is either a TMDB poster_path ("/abc.jpg") or an image URL (Trakt CDN, fallback).
     """
-    grid = Image.new('RGB', (POSTER_WIDTH * GRID_COLS, POSTER_HEIGHT * GRID_ROWS), (0, 0, 0))
+    if poster.startswith("/"):
+        return tmdb_image_url(poster, width)
+    if not poster.startswith("http"):
+        return "https://" + poster
+    return poster
+
+
+async def _fetch_image(url, size, semaphore):
+    async with semaphore:
+        return await poster_cache.get_with_digest(url, size)
 
+
+async def fetch_posters(posters, width, height, max_concurrency=MAX_CONCURRENT_DOWNLOADS):
+    """
+    Loads all posters concurrently through the poster cache, fetching the smallest
+    TMDB size that covers a `width` x `height` tile and decoding JPEGs in draft mode.
+    Returns a list of (content_digest, image) aligned with `posters`; failures are (None, None).
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    with metrics.phase("download"):
+        return await asyncio.gather(*(
+            _fetch_image(resolve_poster_url(poster, width), (width, height), semaphore)
+            for poster in posters
+        ))
+
+
+def _load_font():
     try:
-        font = ImageFont.truetype("arial.ttf", 16)
+        return ImageFont.truetype("arial.ttf", 16)
     except:
-        font = ImageFont.load_default()
-
-    async with aiohttp.ClientSession() as session:
-        for index, (url, title) in enumerate(image_data):
-            try:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        img_data = await resp.read()
-                        img = Image.open(BytesIO(img_data)).convert("RGB")
-                    else:
-                        continue
-            except Exception:
-                continue
-
-            img = img.resize((POSTER_WIDTH, POSTER_HEIGHT))
-            draw = ImageDraw.Draw(img)
-
-            # Draw title bar
-            draw.rectangle(
-                [(0, POSTER_HEIGHT - 30), (POSTER_WIDTH, POSTER_HEIGHT)],
-                fill=(0, 0, 0)
-            )
-            draw.text(
-                (10, POSTER_HEIGHT - 25),
-                title,
-                font=font,
-                fill=(255, 255, 255),
-                stroke_width=1,
-                stroke_fill=(0, 0, 0)
-            )
-
-            x = (index % GRID_COLS) * POSTER_WIDTH
-            y = (index // GRID_COLS) * POSTER_HEIGHT
-            grid.paste(img, (x, y))
+        return ImageFont.load_default()
+
+
+def _render_tile(img, title, width, height, style):
+    """
+    Resizes a poster and draws its title bar. Runs in the render pool.
+    Returns the tile as raw RGB bytes, ready for Image.frombytes.
+    """
+    font = _load_font()
+    img = img.resize((width, height))
+    draw = ImageDraw.Draw(img)
+
+    if style == TILE_STYLE_FIXED:
+        # Draw title bar
+        draw.rectangle(
+            [(0, height - 30), (width, height)],
+            fill=(0, 0, 0)
+        )
+        draw.text(
+            (10, height - 25),
+            title,
+            font=font,
+            fill=(255, 255, 255),
+            stroke_width=1,
+            stroke_fill=(0, 0, 0)
+        )
+
+    # Draw title bar (only if there's space)
+    elif height > 100:  # Only add titles if posters are large enough
+        title_bar_height = min(30, height // 5)
+        draw.rectangle(
+            [(0, height - title_bar_height),
+             (width, height)],
+            fill=(0, 0, 0)
+        )
+
+        # Truncate title if too long
+        max_chars = width // 10  # Approximate based on font size
+        display_title = (title[:max_chars - 3] + '...') if len(title) > max_chars else title
+
+        draw.text(
+            (10, height - title_bar_height + 5),
+            display_title,
+            font=font,
+            fill=(255, 255, 255),
+            stroke_width=1,
+            stroke_fill=(0, 0, 0)
+        )
+
+    return img.tobytes()
+
 
+def _encode_canvas(canvas, webp_params):
     buffer = BytesIO()
-    grid.save(buffer, format="WEBP")
-    buffer.seek(0)
-    return buffer
+    canvas.save(buffer, format="WEBP", **webp_params)
+    return buffer.getvalue()
+
+
+def _compose_grid(tiles, num_cols, num_rows, width, height, webp_params):
+    """Pastes finished tiles (raw RGB bytes, or None to leave blank) into the canvas and encodes WEBP."""
+    grid = Image.new('RGB', (width * num_cols, height * num_rows), (0, 0, 0))
+    for index, tile in enumerate(tiles):
+        if tile is None:
+            continue
+        x = (index % num_cols) * width
+        y = (index // num_cols) * height
+        grid.paste(Image.frombytes('RGB', (width, height), tile), (x, y))
+
+    return _encode_canvas(grid, webp_params)
+
+
+async def _build_tiles(image_data, width, height, style):
+    """
+    Returns finished tiles aligned with `image_data`, drawing only the ones missing
+    from the tile cache. Posters that failed to load come back as None.
+    """
+    posters = await fetch_posters([poster for poster, _ in image_data], width, height)
+
+    tiles = [None] * len(image_data)
+    missing = []
+    for index, ((digest, img), (_, title)) in enumerate(zip(posters, image_data)):
+        if img is None:
+            continue
+        key = (digest, title, width, height, style)
+        tiles[index] = tile_cache.get(key)
+        if tiles[index] is None:
+            missing.append((index, key, img, title))
+
+    with metrics.phase("render"):
+        rendered = await asyncio.gather(*(
+            run_render(_render_tile, img, title, width, height, style)
+            for _, _, img, title in missing
+        ))
+    for (index, key, _, _), tile in zip(missing, rendered):
+        tile_cache.put(key, tile)
+        tiles[index] = tile
+
+    return tiles
+
+
+def _flex_layout(num_items, max_width, max_height, min_cols, max_cols):
+    """Returns (num_cols, num_rows, poster_width, poster_height) for the flexible grid."""
+    # Calculate optimal grid layout
+    num_cols = min(max_cols, max(min_cols, int(num_items ** 0.5) + 1))
+    num_rows = (num_items + num_cols - 1) // num_cols
+
+    # Calculate poster dimensions based on grid size and max dimensions
+    poster_width = min(300, max_width // num_cols)
+    poster_height = int(poster_width * 1.5)  # Standard poster aspect ratio
+
+    # Adjust if total height would exceed max_height
+    while num_rows * poster_height > max_height and poster_height > 100:
+        poster_height -= 10
+        poster_width = int(poster_height / 1.5)
+
+    return num_cols, num_rows, poster_width, poster_height
+
+
+async def create_titled_image_grid(image_data):
+    """
+    image_data: List of (poster, title) tuples; poster is an image URL or a TMDB poster_path
+    Returns: BytesIO object with the WEBP image grid
+    """
+    cache_key = _grid_cache_key("fixed", image_data, width=POSTER_WIDTH, height=POSTER_HEIGHT,
+                                cols=GRID_COLS, rows=GRID_ROWS)
+    cached = grid_cache.get(cache_key)
+    if cached is not None:
+        return BytesIO(cached)
+
+    tiles = await _build_tiles(image_data, POSTER_WIDTH, POSTER_HEIGHT, TILE_STYLE_FIXED)
+    with metrics.phase("encode"):
+        data = await run_render(_compose_grid, tiles, GRID_COLS, GRID_ROWS, POSTER_WIDTH, POSTER_HEIGHT, {})
+
+    # Don't pin a grid with missing tiles, a later call may load them
+    if all(tile is not None for tile in tiles):
+        grid_cache.put(cache_key, data)
+    return BytesIO(data)
 
 
 async def create_titled_image_grids(image_data, max_width=1200, max_height=800, min_cols=2, max_cols=4):
@@ -63,7 +222,7 @@ async def create_titled_image_grids(image_data, max_width=1200, max_height=800,
     Creates an image grid that automatically adjusts layout based on number of items.
 
     Args:
-        image_data: List of (poster_url, title) tuples
+        image_data: List of (poster, title) tuples; poster is an image URL or a TMDB poster_path
         max_width: Maximum width of the output image
         max_height: Maximum height of the output image
         min_cols: Minimum number of columns to use
@@ -75,80 +234,217 @@ async def create_titled_image_grids(image_data, max_width=1200, max_height=800,
     if not image_data:
         return None
 
-    # Calculate optimal grid layout
-    num_items = len(image_data)
-    num_cols = min(max_cols, max(min_cols, int(num_items ** 0.5) + 1))
-    num_rows = (num_items + num_cols - 1) // num_cols
+    cache_key = _grid_cache_key("flex", image_data, max_width=max_width, max_height=max_height,
+                                min_cols=min_cols, max_cols=max_cols)
+    cached = grid_cache.get(cache_key)
+    if cached is not None:
+        return BytesIO(cached)
 
-    # Calculate poster dimensions based on grid size and max dimensions
-    poster_width = min(300, max_width // num_cols)
-    poster_height = int(poster_width * 1.5)  # Standard poster aspect ratio
+    num_cols, num_rows, poster_width, poster_height = _flex_layout(
+        len(image_data), max_width, max_height, min_cols, max_cols
+    )
+    tiles = await _build_tiles(image_data, poster_width, poster_height, TILE_STYLE_FLEX)
+    with metrics.phase("encode"):
+        data = await run_render(_compose_grid, tiles, num_cols, num_rows, poster_width, poster_height,
+                                {"quality": 85})
 
-    # Adjust if total height would exceed max_height
-    while num_rows * poster_height > max_height and poster_height > 100:
-        poster_height -= 10
-        poster_width = int(poster_height / 1.5)
+    if all(tile is not None for tile in tiles):
+        grid_cache.put(cache_key, data)
+    return BytesIO(data)
 
-    # Create the grid image
-    grid = Image.new('RGB',
-                     (poster_width * num_cols, poster_height * num_rows),
-                     (0, 0, 0))
 
-    try:
-        font = ImageFont.truetype("arial.ttf", 16)
-    except:
-        font = ImageFont.load_default()
-
-    async with aiohttp.ClientSession() as session:
-        for index, (url, title) in enumerate(image_data):
-            try:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        img_data = await resp.read()
-                        img = Image.open(BytesIO(img_data)).convert("RGB")
-                    # else:
-                    #     # Use fallback image if download fails
-                    #     async with session.get(FALLBACK_POSTER) as resp:
-                    #         img_data = await resp.read()
-                    #         img = Image.open(BytesIO(img_data)).convert("RGB")
-            except Exception as e:
-                print(f"Error loading image {url}: {e}")
-                continue
-
-            # Resize and add title
-            img = img.resize((poster_width, poster_height))
-            draw = ImageDraw.Draw(img)
-
-            # Draw title bar (only if there's space)
-            if poster_height > 100:  # Only add titles if posters are large enough
-                title_bar_height = min(30, poster_height // 5)
-                draw.rectangle(
-                    [(0, poster_height - title_bar_height),
-                     (poster_width, poster_height)],
-                    fill=(0, 0, 0)
-                )
+def collage_render_stats():
+    """Returns {"COLSxROWS": (renders, avg_ms, max_ms)} over the recent samples of each size."""
+    return {
+        size: (len(times), sum(times) / len(times) * 1000, max(times) * 1000)
+        for size, times in collage_render_times.items() if times
+    }
+
+
+async def create_collage(image_data, num_cols, num_rows, tile_width, tile_height):
+    """
+    Renders a num_cols x num_rows collage for the large chart commands (!t9/!t16/!t25).
+
+    Tiles are streamed into the canvas: at most COLLAGE_WINDOW posters are being
+    loaded/drawn at any moment and each one is released as soon as it is pasted, so
+    peak memory is the canvas plus a fixed window no matter how many tiles there are.
 
-                # Truncate title if too long
-                max_chars = poster_width // 10  # Approximate based on font size
-                display_title = (title[:max_chars - 3] + '...') if len(title) > max_chars else title
-
-                draw.text(
-                    (10, poster_height - title_bar_height + 5),
-                    display_title,
-                    font=font,
-                    fill=(255, 255, 255),
-                    stroke_width=1,
-                    stroke_fill=(0, 0, 0)
+    Returns (BytesIO with the WEBP collage, render seconds).
+    """
+    cache_key = _grid_cache_key("collage", image_data, cols=num_cols, rows=num_rows,
+                                width=tile_width, height=tile_height)
+    cached = grid_cache.get(cache_key)
+    if cached is not None:
+        return BytesIO(cached), 0.0
+
+    start = time.perf_counter()
+    canvas = Image.new('RGB', (tile_width * num_cols, tile_height * num_rows), (0, 0, 0))
+    window = asyncio.Semaphore(COLLAGE_WINDOW)
+    complete = True
+
+    async def place(index, poster, title):
+        nonlocal complete
+        async with window:
+            with metrics.phase("download"):
+                digest, img = await poster_cache.get_with_digest(
+                    resolve_poster_url(poster, tile_width), (tile_width, tile_height)
                 )
+            if img is None:
+                complete = False
+                return
+            key = (digest, title, tile_width, tile_height, TILE_STYLE_FLEX)
+            tile = tile_cache.get(key)
+            if tile is None:
+                with metrics.phase("render"):
+                    tile = await run_render(_render_tile, img, title, tile_width, tile_height, TILE_STYLE_FLEX)
+                tile_cache.put(key, tile)
+            x = (index % num_cols) * tile_width
+            y = (index // num_cols) * tile_height
+            canvas.paste(Image.frombytes('RGB', (tile_width, tile_height), tile), (x, y))
+
+    await asyncio.gather(*(
+        place(index, poster, title)
+        for index, (poster, title) in enumerate(image_data[:num_cols * num_rows])
+    ))
+    with metrics.phase("encode"):
+        data = await run_render(_encode_canvas, canvas, {"quality": 85})
+    elapsed = time.perf_counter() - start
+
+    collage_render_times.setdefault(
+        f"{num_cols}x{num_rows}", deque(maxlen=COLLAGE_TIMING_SAMPLES)
+    ).append(elapsed)
+
+    if complete:
+        grid_cache.put(cache_key, data)
+    return BytesIO(data), elapsed
+
+
+# Year in review layout
+RECAP_WIDTH = 960
+RECAP_MARGIN = 24
+RECAP_BACKGROUND = (24, 25, 28)
+RECAP_TEXT = (235, 235, 235)
+RECAP_MUTED = (140, 140, 145)
+RECAP_ACCENT = (29, 185, 84)
+# Cell colours: empty, then four intensity levels towards the accent colour
+RECAP_LEVELS = np.array([(45, 47, 52), (14, 68, 41), (0, 109, 50), (38, 166, 65), (57, 211, 83)], dtype=np.uint8)
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def _cell_grid(levels, cell, gap):
+    """
+    Renders a 2D array of colour levels as square cells with gaps, in one go:
+    the palette lookup and the upscaling are array operations, not one rectangle per cell.
+    """
+    pitch = cell + gap
+    pixels = np.repeat(np.repeat(RECAP_LEVELS[levels], pitch, axis=0), pitch, axis=1)
+    pixels[np.arange(pixels.shape[0]) % pitch >= cell, :] = RECAP_BACKGROUND
+    pixels[:, np.arange(pixels.shape[1]) % pitch >= cell] = RECAP_BACKGROUND
+    return Image.fromarray(np.ascontiguousarray(pixels[:-gap, :-gap]), "RGB")
+
+
+def _quartile_levels(values):
+    """0 for zero, 1-4 by quartile of the non-zero values."""
+    active = values[values > 0]
+    if not len(active):
+        return np.zeros(values.shape, dtype=np.intp)
+    thresholds = np.quantile(active, [0.25, 0.5, 0.75])
+    return np.where(values > 0, 1 + np.searchsorted(thresholds, values, side="left"), 0)
+
+
+def _recap_font(size):
+    try:
+        return ImageFont.truetype("arial.ttf", size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size)
+        except TypeError:  # Pillow < 10.1 only has the small bitmap font
+            return ImageFont.load_default()
+
+
+def _render_year_in_review(report, heading):
+    """Draws the recap from a year_in_review() report and encodes it. Runs in the render pool."""
+    title_font = _recap_font(28)
+    font = _recap_font(15)
+    canvas = Image.new("RGB", (RECAP_WIDTH, 1000), RECAP_BACKGROUND)
+    draw = ImageDraw.Draw(canvas)
+    x0 = RECAP_MARGIN
+    y = RECAP_MARGIN
+
+    draw.text((x0, y), heading, font=title_font, fill=RECAP_TEXT)
+    y += 44
+    summary = (f"{format_hours(report['minutes'])} watched  ·  {report['episodes']:,} episodes  ·  "
+               f"{report['movies']:,} movies  ·  {report['active_days']} active days")
+    draw.text((x0, y), summary, font=font, fill=RECAP_ACCENT)
+    y += 24
+    highlights = []
+    if report["longest_streak"]:
+        highlights.append(f"Longest streak: {report['longest_streak'][0]} days from {report['longest_streak'][1]}")
+    if report["busiest_day"]:
+        highlights.append(f"Busiest day: {report['busiest_day'][0]} plays on {report['busiest_day'][1]}")
+    draw.text((x0, y), "  ·  ".join(highlights), font=font, fill=RECAP_MUTED)
+    y += 40
+
+    # Calendar heatmap: a column per week, Monday on top
+    plays_per_day = report["plays_per_day"]
+    slots = report["first_weekday"] + np.arange(len(plays_per_day))
+    levels = np.zeros((7, (slots[-1] // 7) + 1), dtype=np.intp)
+    levels[slots % 7, slots // 7] = _quartile_levels(plays_per_day)
+    heatmap = _cell_grid(levels, 13, 3)
+    for row in (0, 2, 4):
+        draw.text((x0, y + row * 16), WEEKDAYS[row], font=font, fill=RECAP_MUTED)
+    canvas.paste(heatmap, (x0 + 44, y))
+    y += heatmap.height + 36
+
+    # Weekday x hour on the left, minutes per month on the right
+    draw.text((x0, y), "When you watch (UTC)", font=font, fill=RECAP_TEXT)
+    draw.text((x0 + 520, y), "Hours per month", font=font, fill=RECAP_TEXT)
+    y += 28
+    clock = _cell_grid(_quartile_levels(report["weekday_hour"]), 16, 3)
+    for row, day in enumerate(WEEKDAYS):
+        draw.text((x0, y + row * 19), day, font=font, fill=RECAP_MUTED)
+    canvas.paste(clock, (x0 + 44, y))
+    for hour in range(0, 24, 6):
+        draw.text((x0 + 44 + hour * 19, y + clock.height + 4), f"{hour:02}", font=font, fill=RECAP_MUTED)
+
+    chart_height = clock.height
+    months = report["minutes_per_month"]
+    tallest = months.max() or 1
+    bar_x = x0 + 520
+    for index, minutes in enumerate(months):
+        bar = int(minutes / tallest * chart_height)
+        left = bar_x + index * 34
+        if bar:
+            draw.rectangle([(left, y + chart_height - bar), (left + 24, y + chart_height)], fill=RECAP_ACCENT)
+        draw.text((left, y + chart_height + 4), MONTHS[index][0], font=font, fill=RECAP_MUTED)
+    y += chart_height + 40
+
+    # Top lists and genre shares in three columns
+    columns = [
+        ("Top shows", [f"{title} · {plays} plays" for title, plays, _ in report["top_shows"]]),
+        ("Top movies", [f"{title} · {format_hours(minutes)}" for title, _, minutes in report["top_movies"]]),
+        ("Genres", [f"{genre} {share * 100:.0f}%" for genre, share in report["genres"]]),
+    ]
+    column_width = (RECAP_WIDTH - 2 * RECAP_MARGIN) // len(columns)
+    bottom = y
+    for index, (name, lines) in enumerate(columns):
+        left = x0 + index * column_width
+        draw.text((left, y), name, font=font, fill=RECAP_TEXT)
+        line_y = y + 28
+        max_chars = column_width // 9
+        for line in lines or ["-"]:
+            line = (line[:max_chars - 3] + "...") if len(line) > max_chars else line
+            draw.text((left, line_y), line, font=font, fill=RECAP_MUTED)
+            line_y += 22
+        bottom = max(bottom, line_y)
 
-            # Calculate position in grid
-            x = (index % num_cols) * poster_width
-            y = (index // num_cols) * poster_height
-            grid.paste(img, (x, y))
+    canvas = canvas.crop((0, 0, RECAP_WIDTH, bottom + RECAP_MARGIN))
+    return _encode_canvas(canvas, {"quality": 90})
 
-    # Convert to BytesIO
-    img_bytes = BytesIO()
-    grid.save(img_bytes, format='WEBP', quality=85)
-    img_bytes.seek(0)
 
-    return img_bytes
+async def create_year_in_review(report, heading):
+    """Renders a utils.analytics.year_in_review() report as one WEBP image. Returns a BytesIO."""
+    with metrics.phase("render"):
+        data = await run_render(_render_year_in_review, report, heading)
+    return BytesIO(data)
@@ -0,0 +1,186 @@
+import asyncio
+
+import discord
+
+from database.database import (
+    save_import_job, update_import_job, get_unfinished_import_jobs, count_total_scrobbles,
+    get_metadata_backfill_usernames
+)
+from utils.rate_limit import BACKGROUND, request_priority
+from utils.trakt_utils import sync_history
+from utils.user_registry import user_registry
+
+# Full imports running at once; the rest wait in line
+IMPORT_WORKERS = 2
+# Jobs waiting in line before new ones are turned away
+IMPORT_QUEUE_SIZE = 50
+# Minimum seconds between progress edits of the same message
+PROGRESS_EDIT_INTERVAL = 2
+
+
+class ImportJob:
+    def __init__(self, username, channel_id, message_id):
+        self.username = username
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.status = "queued"
+        self.pages_fetched = 0
+        self.rows_written = 0
+        self.finished = asyncio.Event()
+
+    def progress_text(self):
+        if self.status == "queued":
+            return f"⏳ Import for `{self.username}` is queued..."
+        return (f"🔄 Importing history for `{self.username}`: "
+                f"{self.pages_fetched} pages fetched, {self.rows_written} rows written...")
+
+
+class ImportQueue:
+    """
+    Bounded queue of full history imports (!tset).
+
+    A fixed number of workers run jobs in arrival order. Only one job per Trakt
+    username exists at a time. Each job reports progress by editing a single
+    message in place. Jobs are persisted in the import_jobs table and re-queued
+    on startup, so a restart doesn't lose an import.
+
+    Linked users whose stored plays predate ids and metadata (see migration 7) are
+    re-imported in the background after startup, one at a time, without a message.
+    """
+
+    def __init__(self, workers=IMPORT_WORKERS, max_queued=IMPORT_QUEUE_SIZE):
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.jobs = {}
+        self._bot = None
+        self._tasks = []
+        self._backfill_task = None
+
+    async def start(self, bot):
+        """Spawns the workers and re-queues jobs left unfinished by the previous run."""
+        self._bot = bot
+        for username, channel_id, message_id in await asyncio.to_thread(get_unfinished_import_jobs):
+            self._enqueue(ImportJob(username, channel_id, message_id))
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._backfill_task = asyncio.create_task(self._run_backfills())
+
+    async def stop(self):
+        tasks = self._tasks + ([self._backfill_task] if self._backfill_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._backfill_task = None
+
+    async def _run_backfills(self):
+        """
+        Full imports for the users migration 7 marked; the import clears the marker once the
+        metadata is filled in. One job at a time, so tset imports still find room in the queue.
+        A failed import keeps the marker and is retried after the next restart.
+        """
+        linked = {username for _, username in user_registry.items()}
+        for username in await asyncio.to_thread(get_metadata_backfill_usernames):
+            if username not in linked:
+                # Nothing of theirs is shown until they tset again, which imports everything anyway
+                continue
+            job = self.jobs.get(username)
+            if job is None:
+                job = ImportJob(username, None, None)
+                self.jobs[username] = job
+                await self.queue.put(job)
+            await job.finished.wait()
+
+    async def submit(self, username, channel_id, message_id):
+        """
+        Queues a full import. Returns (job, created): an already active job for the
+        same username is returned as-is, and job is None when the queue is full.
+        """
+        if username in self.jobs:
+            job = self.jobs[username]
+            if job.message_id is None:
+                # A background backfill: report its progress in this message from now on
+                job.channel_id, job.message_id = channel_id, message_id
+                return job, True
+            return job, False
+        if self.queue.full():
+            return None, False
+
+        # Claim the username before yielding, so a second tset can't create a duplicate job
+        job = ImportJob(username, channel_id, message_id)
+        self.jobs[username] = job
+        # Saved before it's queued, so a worker's status updates can't land before the insert
+        await asyncio.to_thread(save_import_job, username, channel_id, message_id)
+        await self.queue.put(job)
+        return job, True
+
+    def _enqueue(self, job):
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return False
+        self.jobs[job.username] = job
+        return True
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run(job)
+            except Exception as e:
+                print(f"Import for {job.username} failed: {e!r}")
+                job.status = "failed"
+                await self._save_progress(job)
+                await self._edit(job, f"❌ Import for `{job.username}` failed, please try `tset` again later.")
+            finally:
+                self.jobs.pop(job.username, None)
+                job.finished.set()
+                self.queue.task_done()
+
+    async def _run(self, job):
+        job.status = "running"
+        await self._save_progress(job)
+
+        def on_page(page_count):
+            job.pages_fetched += 1
+
+        def on_batch(rows):
+            job.rows_written += rows
+
+        async def report_progress():
+            # Edits are throttled so a fast import doesn't hit Discord's rate limits
+            while True:
+                await asyncio.sleep(PROGRESS_EDIT_INTERVAL)
+                await self._save_progress(job)
+                await self._edit(job, job.progress_text())
+
+        await self._edit(job, job.progress_text())
+        reporter = asyncio.create_task(report_progress())
+        try:
+            # Imports yield Trakt's rate budget to commands people are waiting on
+            with request_priority(BACKGROUND):
+                await sync_history(job.username, full=True, on_page=on_page, on_batch=on_batch)
+        finally:
+            reporter.cancel()
+
+        job.status = "done"
+        await self._save_progress(job)
+        movies, shows = await asyncio.to_thread(count_total_scrobbles, job.username)
+        await self._edit(job, f"✅ History saved for `{job.username}`! 🎬 {movies} movies | 📺 {shows} episodes")
+
+    async def _save_progress(self, job):
+        # A running import holds the database for its batches; never wait on it from the event loop
+        await asyncio.to_thread(update_import_job, job.username, job.status, job.pages_fetched, job.rows_written)
+
+    async def _edit(self, job, content):
+        if self._bot is None or job.message_id is None:
+            return
+        channel = self._bot.get_channel(job.channel_id)
+        try:
+            if channel is None:
+                channel = await self._bot.fetch_channel(job.channel_id)
+            await channel.get_partial_message(job.message_id).edit(content=content)
+        except discord.HTTPException as e:
+            print(f"Couldn't update import progress for {job.username}: {e!r}")
+
+
+import_queue = ImportQueue()
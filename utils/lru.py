@@ -0,0 +1,68 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Least-recently-used mapping bounded by entry count and/or total size.
+
+    Args:
+        max_items: Maximum number of entries (None for no limit)
+        max_bytes: Maximum total size of all entries (None for no limit)
+        sizeof: Callable returning the size of a value in bytes
+    """
+
+    def __init__(self, max_items=None, max_bytes=None, sizeof=len):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            value, _ = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Would evict everything else and still not fit
+            self.pop(key)
+            return
+
+        self.pop(key)
+        self._data[key] = (value, size)
+        self.total_bytes += size
+        self._evict()
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        self.total_bytes -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        self._data.clear()
+        self.total_bytes = 0
+
+    def _evict(self):
+        while self._data and (
+            (self.max_items is not None and len(self._data) > self.max_items) or
+            (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            _, (_, size) = self._data.popitem(last=False)
+            self.total_bytes -= size
@@ -0,0 +1,127 @@
+import contextlib
+import contextvars
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Command being handled in the current task, so phase timings can be attributed to it
+current_command = contextvars.ContextVar("current_command", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimates the q-quantile by interpolating inside the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    return lower  # +Inf bucket, the best we can say is "more than the last bound"
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    In-process counters and latency histograms, keyed by metric name and label values.
+
+    Everything runs on the event loop, so no locking is needed. Values are exported
+    as Prometheus text by render_prometheus() and summarised by !tstats.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self._collected = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, name, value=1, **labels):
+        self.counters[self._key(name, labels)] += value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observes the wall time spent inside the block (including awaits) into `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def phase(self, phase):
+        """Times one phase of handling a command (trakt_fetch, render, discord_send, ...)."""
+        return self.timer("trakt_fm_phase_seconds", phase=phase, command=current_command.get())
+
+    def collect(self, name, fn, kind="gauge"):
+        """
+        Registers `fn() -> {labels: value}` (labels as a tuple of (key, value) pairs) to be
+        read at export time, for values that already live elsewhere, like cache hit counts.
+        """
+        self._collected[name] = (fn, kind)
+
+    def counter_values(self, name):
+        return {labels: value for (n, labels), value in self.counters.items() if n == name}
+
+    def histogram_values(self, name):
+        return {labels: h for (n, labels), h in self.histograms.items() if n == name}
+
+    def render_prometheus(self):
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        for name in sorted({n for n, _ in self.counters}):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(self.counter_values(name).items()):
+                lines.append(f"{name}{fmt(labels)} {value:g}")
+
+        for name in sorted({n for n, _ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for labels, h in sorted(self.histogram_values(name).items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', f'{bound:g}')])} {cumulative}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {h.count}")
+                lines.append(f"{name}_sum{fmt(labels)} {h.sum:g}")
+                lines.append(f"{name}_count{fmt(labels)} {h.count}")
+
+        for name, (fn, kind) in sorted(self._collected.items()):
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(fn().items()):
+                lines.append(f"{name}{fmt(labels)} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
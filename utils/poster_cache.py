@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from utils.http import fetch
+from utils.lru import LRUCache
+from utils.rate_limit import image_limiter
+from utils.render_pool import run_render
+
+IMAGE_CACHE_DIR = "image_cache"
+MEMORY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DISK_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Posters rarely change; after this many seconds an entry is revalidated upstream
+POSTER_TTL = 7 * 24 * 60 * 60
+
+
+def _image_size(entry):
+    _, img = entry
+    return img.width * img.height * len(img.getbands())
+
+
+def _atomic_write(path, data):
+    """Writes `data` to `path` through a temp file + rename so readers never see a partial file."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _decode(data, size=None):
+    """
+    Decodes image bytes to RGB. With `size`, JPEGs are decoded in draft mode, letting
+    libjpeg downscale by a power of two while decoding (never below `size`).
+    """
+    img = Image.open(BytesIO(data))
+    if size is not None and img.format == "JPEG":
+        img.draft("RGB", size)
+    return img.convert("RGB")
+
+
+class PosterCache:
+    """
+    Two-tier poster cache.
+
+    Decoded images live in a bounded in-memory LRU keyed by URL and target size. Underneath it,
+    raw image bytes are stored on disk by content hash (objects/) with a small
+    per-URL ref file (refs/) that records the hash, fetch time and validators.
+    Stale refs are revalidated with a conditional GET; if the upstream is
+    unreachable the stale copy is served.
+    """
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_memory_bytes=MEMORY_CACHE_MAX_BYTES,
+                 max_disk_bytes=DISK_CACHE_MAX_BYTES, ttl=POSTER_TTL):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.memory = LRUCache(max_bytes=max_memory_bytes, sizeof=_image_size)
+        self.disk_hits = 0
+        self.network_fetches = 0
+        self._disk_bytes = None
+        self._evict_lock = asyncio.Lock()
+
+    # --- paths ---
+
+    def _ref_path(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "refs", key[:2], key + ".json")
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest[:2], digest)
+
+    # --- disk tier (runs in a worker thread) ---
+
+    def _read_ref(self, url):
+        try:
+            with open(self._ref_path(url), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_ref(self, url, ref):
+        _atomic_write(self._ref_path(url), json.dumps(ref).encode("utf-8"))
+
+    def _load_object(self, digest):
+        path = self._object_path(digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mtime doubles as last-access time for eviction
+        except OSError:
+            return None
+        return data
+
+    def _store_object(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+            return digest, 0
+        _atomic_write(path, data)
+        return digest, len(data)
+
+    def _scan_disk_usage(self):
+        total = 0
+        for root, _, files in os.walk(os.path.join(self.cache_dir, "objects")):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def _evict_disk(self, target_bytes):
+        """Deletes least-recently-used objects until usage drops to `target_bytes`."""
+        objects = []
+        for root, _, files in os.walk(os.path.join(self.cache_dir, "objects")):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                objects.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in objects)
+        for _, size, path in sorted(objects):
+            if total <= target_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+        return total
+
+    async def _account_disk_write(self, written):
+        if self._disk_bytes is None:
+            self._disk_bytes = await asyncio.to_thread(self._scan_disk_usage)
+        else:
+            self._disk_bytes += written
+
+        if self._disk_bytes > self.max_disk_bytes and not self._evict_lock.locked():
+            async with self._evict_lock:
+                # Evict down to 90% so we don't rescan on every subsequent write
+                self._disk_bytes = await asyncio.to_thread(self._evict_disk, int(self.max_disk_bytes * 0.9))
+
+    # --- network tier ---
+
+    async def _fetch(self, url, ref=None):
+        """
+        Returns (status, data, headers). A 304 means the cached ref is still valid.
+        Network errors come back as status 0.
+        """
+        headers = {}
+        if ref:
+            if ref.get("etag"):
+                headers["If-None-Match"] = ref["etag"]
+            if ref.get("last_modified"):
+                headers["If-Modified-Since"] = ref["last_modified"]
+
+        return await fetch(url, image_limiter, headers=headers, read="bytes")
+
+    # --- public API ---
+
+    async def get(self, url, size=None):
+        """
+        Returns the decoded RGB poster for `url`, or None if it can't be loaded.
+        `size` is the (width, height) the caller will scale to; it enables draft decoding
+        and is part of the memory key, since the decoded image depends on it.
+        """
+        _, img = await self.get_with_digest(url, size)
+        return img
+
+    async def get_with_digest(self, url, size=None):
+        """Like get(), but returns (content_digest, image), or (None, None) on failure."""
+        now = time.time()
+        memory_key = (url, size)
+
+        entry = self.memory.get(memory_key)
+        if entry is not None and now - entry[0]["fetched_at"] < self.ttl:
+            return entry[0]["digest"], entry[1]
+
+        ref = entry[0] if entry is not None else await asyncio.to_thread(self._read_ref, url)
+        img = entry[1] if entry is not None else None
+
+        if ref is not None and img is None:
+            data = await asyncio.to_thread(self._load_object, ref["digest"])
+            if data is not None:
+                try:
+                    img = await run_render(_decode, data, size)
+                except OSError:
+                    img = None  # corrupt object, refetch below
+            if img is None:
+                ref = None
+
+        if ref is not None and now - ref["fetched_at"] < self.ttl:
+            self.disk_hits += 1
+            self.memory.put(memory_key, (ref, img))
+            return ref["digest"], img
+
+        # Missing or stale: go upstream (conditionally, if we have a copy)
+        status, data, headers = await self._fetch(url, ref)
+        self.network_fetches += 1
+
+        if status == 304 and ref is not None:
+            ref["fetched_at"] = now
+            await asyncio.to_thread(self._write_ref, url, ref)
+            self.memory.put(memory_key, (ref, img))
+            return ref["digest"], img
+
+        if status == 200 and data:
+            try:
+                img = await run_render(_decode, data, size)
+            except OSError as e:
+                print(f"Error decoding image {url}: {e!r}")
+                return None, None
+            digest, written = await asyncio.to_thread(self._store_object, data)
+            ref = {
+                "digest": digest,
+                "fetched_at": now,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified")
+            }
+            await asyncio.to_thread(self._write_ref, url, ref)
+            await self._account_disk_write(written)
+            self.memory.put(memory_key, (ref, img))
+            return ref["digest"], img
+
+        # Upstream failed; a stale copy is better than nothing
+        if ref is not None and img is not None:
+            return ref["digest"], img
+        return None, None
+
+
+poster_cache = PosterCache()
@@ -0,0 +1,94 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import time
+
+# Lower value = served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def request_priority(priority):
+    """
+    Sets the priority of every upstream request made inside the block, including from
+    tasks it spawns. Background imports use BACKGROUND so commands are served first.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Token-bucket limiter shared by every caller of one upstream.
+
+    `rate` tokens are added per second up to `capacity`. When callers have to wait,
+    the oldest interactive waiter is served before any background waiter. pause()
+    empties the bucket until a deadline, for honouring Retry-After.
+    """
+
+    def __init__(self, name, rate, capacity):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.waited = 0
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._dispatcher = None
+
+    def _refill(self):
+        now = time.monotonic()
+        if now < self._paused_until:
+            self._updated = now
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        self._refill()
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+
+        self.waited += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (_priority.get(), next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self._waiters:
+            self._refill()
+            if self.tokens >= 1:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():  # skip callers that gave up (cancelled)
+                    self.tokens -= 1
+                    future.set_result(None)
+                continue
+            delay = max(self._paused_until - time.monotonic(), (1 - self.tokens) / self.rate)
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        """Stops handing out tokens for `seconds` (e.g. from a 429's Retry-After)."""
+        self.tokens = 0
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        print(f"{self.name} rate limited, pausing for {seconds:.1f}s")
+
+
+# Trakt allows ~1000 calls per 5 minutes per API key
+trakt_limiter = TokenBucket("Trakt", rate=1000 / 300, capacity=20)
+# TMDB allows roughly 40-50 requests per second
+tmdb_limiter = TokenBucket("TMDB", rate=20, capacity=40)
+# Poster CDNs (image.tmdb.org, walter.trakt.tv); generous, mostly to smooth bursts
+image_limiter = TokenBucket("Images", rate=50, capacity=50)
@@ -0,0 +1,45 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# "thread" (default) or "process". Pillow releases the GIL while decoding, resizing
+# and encoding, so threads already scale across cores without pickling images.
+RENDER_POOL = os.getenv("RENDER_POOL", "thread")
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "0"))
+
+_executor = None
+
+
+def _available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        workers = RENDER_WORKERS or _available_cores()
+        if RENDER_POOL == "process":
+            _executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+    return _executor
+
+
+async def run_render(fn, *args, **kwargs):
+    """
+    Runs CPU-bound image work (decode, resize, draw, encode) off the event loop.
+    With a process pool, `fn` must be a module-level function and arguments must pickle.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def shutdown_render_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
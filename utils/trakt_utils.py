@@ -1,6 +1,136 @@
-from database.database import save_history_to_db
+import asyncio
+import time
 
-def save_recent_trakt_data(username, history):
-    recent_movies = [entry for entry in history if 'movie' in entry]
-    recent_shows = [entry for entry in history if 'show' in entry]
-    save_history_to_db(username, recent_shows, recent_movies)
+from database.database import (
+    bulk_ingest_history, get_sync_state, get_latest_stored_play, save_sync_state
+)
+from trakt_api import TraktAPIError, get_full_history
+
+# Guild commands sync at most this many members per invocation, least recently refreshed
+# first, so one big server can't drain the Trakt budget the single-user commands rely on
+BATCH_REFRESH_BUDGET = 10
+BATCH_REFRESH_CONCURRENCY = 5
+# Members refreshed this recently are served from the local history as-is
+BATCH_REFRESH_MAX_AGE = 10 * 60
+
+# username -> monotonic time of the last successful refresh_history
+_refreshed_at = {}
+
+
+class HistorySyncError(Exception):
+    """Some fetched plays couldn't be stored; the high-water mark was left where it was."""
+
+
+def _newest_play(history, current=None):
+    """Returns (watched_at, history_id) of the newest entry, never moving backwards from `current`."""
+    newest = current
+    for entry in history:
+        watched_at = entry.get("watched_at")
+        if watched_at and (newest is None or newest[0] is None or watched_at > newest[0]):
+            newest = (watched_at, entry.get("id"))
+    return newest
+
+async def sync_history(username, full=False, on_page=None, on_batch=None):
+    """
+    Brings the local history for `username` up to date and returns the number of plays fetched.
+
+    Incremental mode asks Trakt only for plays at or after the stored high-water
+    mark (one small request in steady state). Full mode re-downloads everything and
+    is only used by import jobs. An incremental sync with nothing local to resume from
+    does nothing and returns 0: the user's queued import will fetch the history.
+    `on_page` / `on_batch` are passed through to get_full_history / bulk_ingest_history.
+    Raises HistorySyncError when a batch fails to save, without moving the high-water
+    mark, so the next sync fetches those plays again.
+    """
+    # Every database call runs in a thread: the ingest lock can be held by an import for seconds
+    state = None
+    has_sync_state = False
+    if not full:
+        state = await asyncio.to_thread(get_sync_state, username)
+        has_sync_state = state is not None
+        if state is None:
+            # Users imported before sync_state existed: resume from their newest stored play
+            state = await asyncio.to_thread(get_latest_stored_play, username)
+        if state is None or state[0] is None:
+            return 0
+
+    if full:
+        shows, movies = await asyncio.gather(
+            get_full_history(username, "shows", on_page=on_page),
+            get_full_history(username, "movies", on_page=on_page)
+        )
+        _, failed = await asyncio.to_thread(
+            bulk_ingest_history, username, shows + movies, on_batch=on_batch, full=True
+        )
+        if failed:
+            raise HistorySyncError(f"{len(failed)} of {len(shows) + len(movies)} plays couldn't be saved")
+        newest = _newest_play(shows + movies)
+        if newest is not None:
+            await asyncio.to_thread(save_sync_state, username, newest[0], newest[1], full_sync=True)
+        return len(shows) + len(movies)
+
+    last_watched_at, last_history_id = state
+    history = await get_full_history(username, start_at=last_watched_at, on_page=on_page)
+    # start_at is inclusive, so the high-water entry itself comes back again
+    history = [entry for entry in history if entry.get("id") != last_history_id]
+    if history:
+        _, failed = await asyncio.to_thread(bulk_ingest_history, username, history, on_batch=on_batch)
+        if failed:
+            raise HistorySyncError(f"{len(failed)} of {len(history)} plays couldn't be saved")
+        newest = _newest_play(history, state)
+        await asyncio.to_thread(save_sync_state, username, newest[0], newest[1])
+    elif not has_sync_state:
+        await asyncio.to_thread(save_sync_state, username, last_watched_at, last_history_id)
+    return len(history)
+
+
+async def refresh_history(username):
+    """
+    sync_history for interactive commands: a failed sync is logged and the command
+    carries on with whatever is already stored locally.
+    """
+    try:
+        fetched = await sync_history(username)
+    except (TraktAPIError, HistorySyncError) as e:
+        print(f"Couldn't sync history for {username}: {e}")
+        return 0
+    _refreshed_at[username] = time.monotonic()
+    return fetched
+
+
+async def refresh_histories(usernames, budget=BATCH_REFRESH_BUDGET, max_age=BATCH_REFRESH_MAX_AGE):
+    """
+    Brings many users' local histories up to date concurrently, for guild-wide commands.
+
+    Only incremental syncs are done: users refreshed in the last `max_age` seconds and
+    users with nothing stored yet (their import job takes care of them) are skipped, and
+    at most `budget` of the rest are synced, stalest first. Every request still goes
+    through the shared Trakt limiter. Returns the number of users synced.
+    """
+    now = time.monotonic()
+    stale = [
+        username for username in dict.fromkeys(usernames)
+        if now - _refreshed_at.get(username, float("-inf")) > max_age
+    ]
+    stale.sort(key=lambda username: _refreshed_at.get(username, float("-inf")))
+
+    def pick_batch():
+        batch = []
+        for username in stale:
+            if len(batch) >= budget:
+                break
+            if get_sync_state(username) is not None or get_latest_stored_play(username) is not None:
+                batch.append(username)
+        return batch
+
+    # Up to a guild's worth of sync-state lookups; keep them off the event loop
+    batch = await asyncio.to_thread(pick_batch)
+
+    semaphore = asyncio.Semaphore(BATCH_REFRESH_CONCURRENCY)
+
+    async def refresh(username):
+        async with semaphore:
+            await refresh_history(username)
+
+    await asyncio.gather(*(refresh(username) for username in batch))
+    return len(batch)
@@ -0,0 +1,64 @@
+import asyncio
+
+from database.database import load_registered_users, save_registered_users
+from utils.metrics import metrics
+
+# Seconds to wait after a change before persisting, so bursts of !tset become one write
+FLUSH_DELAY = 2
+
+
+class UserRegistry:
+    """
+    Discord id -> Trakt username mapping, loaded once at startup and served from memory.
+
+    Changes are applied to memory immediately (so concurrent !tset calls can't lose
+    each other's registrations) and written behind to the `users` table in a single
+    transaction shortly after.
+    """
+
+    def __init__(self):
+        self._users = {}
+        self._dirty = {}
+        self._flush_task = None
+
+    def load(self):
+        self._users = load_registered_users()
+
+    def get(self, discord_id):
+        with metrics.phase("registry_lookup"):
+            return self._users.get(str(discord_id))
+
+    def __contains__(self, discord_id):
+        return str(discord_id) in self._users
+
+    def items(self):
+        return list(self._users.items())
+
+    def set(self, discord_id, username):
+        discord_id = str(discord_id)
+        self._users[discord_id] = username
+        self._dirty[discord_id] = username
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(FLUSH_DELAY)
+        await self.flush()
+
+    async def flush(self):
+        """Persists pending changes. Failed writes stay pending for the next flush."""
+        if not self._dirty:
+            return
+        pending, self._dirty = self._dirty, {}
+        try:
+            await asyncio.to_thread(save_registered_users, pending)
+        except Exception as e:
+            print(f"Error saving user registry: {e!r}")
+            # Keep anything set in the meantime, it's newer than what we tried to write
+            self._dirty = {**pending, **self._dirty}
+
+
+user_registry = UserRegistry()